@@ -0,0 +1,143 @@
+# Deterministic synthetic documents for the benchmark.
+# generate(language, lines, seed) --> text with roughly `lines` lines.
+import random
+
+
+def python(lines, seed=1):
+    rnd = random.Random(seed)
+    out = []
+    lvl = 0
+    while len(out) < lines:
+        r = rnd.random()
+        ind = "    " * lvl
+        n = len(out)
+        if r < 0.10 and lvl < 5:
+            if rnd.random() < 0.2:
+                out.append(f"{ind}@decorator_{n}")
+            kw = "class" if rnd.random() < 0.25 else "def"
+            out.append(f"{ind}{kw} name_{n}(self, arg_{n}, *args, **kwargs):")
+            if rnd.random() < 0.4:
+                out.append(f'{ind}    """Docstring {n}."""')
+            lvl += 1
+        elif r < 0.18 and lvl > 0:
+            lvl = rnd.randrange(0, lvl)
+            out.append(f"{'    ' * lvl}value_{n} = compute({n})")
+        elif r < 0.23:
+            out.append(f"{'    ' * rnd.randrange(0, lvl + 1)}# comment {n}")
+        elif r < 0.30:
+            out.append("")
+        elif r < 0.34:
+            out.append(f"{ind}items = [")
+            out.append(f"{ind}    {n}, {n + 1},")
+            out.append(f"{ind}]")
+        else:
+            out.append(f"{ind}result_{n} = value_{n} + {n}")
+    return "\n".join(out) + "\n"
+
+
+def c_brace(lines, seed=1):
+    rnd = random.Random(seed)
+    out = []
+    while len(out) < lines:
+        n = len(out)
+        r = rnd.random()
+        if r < 0.15:
+            out.append(f"struct record_{n} {{")
+            for k in range(rnd.randrange(2, 8)):
+                out.append(f"    int field_{k};")
+            out.append("};")
+            out.append("")
+            continue
+        if r < 0.25:
+            out.append(f"/* block comment {n}")
+            out.append(" * spanning lines")
+            out.append(" */")
+        ret = rnd.choice(("int", "void", "static int", "char"))
+        out.append(f"{ret} function_{n}(int a, char *b) {{")
+        depth = 1
+        for _ in range(rnd.randrange(4, 40)):
+            ind = "    " * depth
+            m = len(out)
+            x = rnd.random()
+            if x < 0.12 and depth < 6:
+                out.append(f"{ind}if (a > {m}) {{")
+                depth += 1
+            elif x < 0.22 and depth > 1:
+                depth -= 1
+                out.append(f"{'    ' * depth}}}")
+            elif x < 0.28:
+                out.append(f"{ind}// comment {m}")
+            elif x < 0.32:
+                out.append("")
+            else:
+                out.append(f"{ind}a = call_{m}(a, b);")
+        while depth > 1:
+            depth -= 1
+            out.append(f"{'    ' * depth}}}")
+        out.append("}")
+        out.append("")
+    return "\n".join(out) + "\n"
+
+
+def markdown(lines, seed=1):
+    rnd = random.Random(seed)
+    out = []
+    lvl = 1
+    while len(out) < lines:
+        n = len(out)
+        r = rnd.random()
+        if r < 0.08:
+            lvl = max(1, min(6, lvl + rnd.choice((-2, -1, 0, 1, 1))))
+            out.append(f"{'#' * lvl} Heading {n}")
+            out.append("")
+        elif r < 0.14:
+            out.append("```")
+            out.append(f"code_{n}()")
+            out.append("```")
+        elif r < 0.24:
+            out.append(f"- item {n}")
+            out.append(f"    - nested {n}")
+        elif r < 0.30:
+            out.append("")
+        else:
+            out.append(f"Paragraph text {n} with *emphasis* and `code`.")
+    return "\n".join(out) + "\n"
+
+
+def latex(lines, seed=1):
+    rnd = random.Random(seed)
+    titles = ("\\chapter", "\\section", "\\subsection", "\\subsubsection", "\\paragraph")
+    out = ["\\documentclass{book}", "\\begin{document}"]
+    lvl = 0
+    while len(out) < lines:
+        n = len(out)
+        r = rnd.random()
+        if r < 0.07:
+            lvl = max(0, min(len(titles) - 1, lvl + rnd.choice((-2, -1, 0, 1, 1))))
+            star = "*" if rnd.random() < 0.1 else ""
+            out.append(f"{titles[lvl]}{star}{{Title {n}}}\\label{{sec:{n}}}")
+        elif r < 0.12:
+            out.append(f"% comment {n}")
+        elif r < 0.18:
+            out.append("\\begin{itemize}")
+            out.append(f"    \\item entry {n}")
+            out.append("\\end{itemize}")
+        elif r < 0.24:
+            out.append("")
+        else:
+            out.append(f"Sentence {n} with $x^{{{n % 7}}}$ inline math.")
+    out.append("\\end{document}")
+    return "\n".join(out) + "\n"
+
+
+# syntax name (as known to the stand-in sublime module) --> generator
+LANGUAGES = {
+    "Python": python,
+    "C": c_brace,
+    "Markdown": markdown,
+    "LaTeX": latex,
+}
+
+
+def generate(language, lines, seed=1):
+    return LANGUAGES[language](lines, seed)
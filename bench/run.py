@@ -0,0 +1,366 @@
+"""Offline benchmark of SymbolBalloon's hot paths.
+
+    python bench/run.py                        compare against bench/baseline.json
+    python bench/run.py --update               rewrite the baseline
+    python bench/run.py --sizes 1000,200000 --languages Python,C
+    python bench/run.py --workers 8             processes for sub/engine.py
+
+The package is imported against the stand-in `sublime` modules in this
+directory, so timings measure the plugin's own work plus a cheap fake API.
+API call counts of a fixed sample of points are exact and machine
+independent, a higher count fails the comparison.  Timings depend on the
+machine and are only reported when slower than the baseline allows.  For source corpora the headless engine (sub/engine.py)
+is run serially and across a process pool, and its result must equal what
+scan_lines left in the cache.  Large file mode and the incremental patch of
+an edited corpus must give the same levels, line starts and balloons as a
+fresh default build.
+"""
+import argparse
+import concurrent.futures
+import importlib
+import json
+import operator as opr
+import os
+import random
+import statistics
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import sublime             # noqa: E402  (the stand-in)
+import sublime_plugin      # noqa: E402,F401
+import corpora             # noqa: E402
+
+API_SAMPLE = 20     # runs whose API calls are compared, whatever --repeat is
+
+
+def load_package(name="SymbolBalloon"):
+    # Sublime Text packages have no __init__.py, import the root as a namespace
+    package = types.ModuleType(name)
+    package.__path__ = [ROOT]
+    sys.modules[name] = package
+    plugin = importlib.import_module(name + ".symbol_balloon")
+    sublime.SETTINGS.update(sublime.read_settings(
+                os.path.join(ROOT, "symbol_balloon.sublime-settings")))
+    sublime.SETTINGS["persistent_cache"] = False
+    plugin.plugin_loaded()
+    return plugin
+
+
+def engine_inputs(vw, Cache):
+    # arguments of engine.scan_text taken from a live (fake) view
+    text = vw.substr(sublime.Region(0, vw.size()))
+    scope = sublime.SETTINGS.get("ignored_scope", "_")
+    spans = [r.to_tuple()  for r in vw.find_by_selector(scope)]
+    return (text, int(vw.settings().get("tab_size", 8)), [*Cache.views["symbol_point"]], 
+            [*Cache.views["symbol_level"]], spans, sublime.SETTINGS.get("ignored_characters", ""))
+
+
+def verify_engine(plugin, vw, pool, workers):
+    # engine output == scan_lines output, [] when equal
+    Cache = plugin.Cache
+    containers = sys.modules["SymbolBalloon.sub.containers"]
+    engine = sys.modules["SymbolBalloon.sub.engine"]
+    Cache.clear()
+    Cache.query_init(vw)
+    text, tab_size, points, levels, spans, chars = engine_inputs(vw, Cache)
+    plugin.scan_lines(vw, points[0], vw.size() + 1, deadline=float("inf"))
+    closed = Cache.views["closed"]
+    mismatches = []
+
+    if [*engine.indentation_levels(text, tab_size, points)] != levels:
+        mismatches.append("indentation_levels")
+
+    next_points = [*points[1:], len(text)]
+    serial = engine.scan_text(text, tab_size, points, next_points, levels, spans, chars)
+    parallel = engine.scan_parallel(text, tab_size, points, levels, spans, chars, pool, workers)
+    for name, results in (("scan_text", serial), ("scan_parallel", parallel)):
+        store = containers.ClosedStore()
+        for lvl, pt in zip(levels, points):
+            store.append(lvl, pt)
+        for idx, (_, true, false) in enumerate(results):
+            store.record(idx, true, false)
+        if ([*map(opr.itemgetter(0), results)] != [*Cache.views["scanned_point"]] or 
+                (store.true, store.false, store.shutter) != 
+                (closed.true, closed.false, closed.shutter)):
+            mismatches.append(name)
+    return mismatches
+
+
+def snapshot(plugin, vw, points):
+    # what every build must agree on: balloons at points in their order, as the balloon 
+    # scans them, the same from the first symbol on, then the whole buffer scanned
+    Cache = plugin.Cache
+    start = Cache.views["symbol_point"][0]
+    sections = lambda vp: [(lvl, sr.name, sr.region.to_tuple())  
+                                for lvl, sr in Cache.sectional_view(vp)[0].items()]
+    balloons, prefixes = [], []
+    for vp in points:
+        top_level_pt = plugin.Balloon.top_level_point(vp + 1)
+        if top_level_pt is not None:
+            plugin.scan_lines(vw, top_level_pt, vp + 1, deadline=float("inf"))
+        balloons.append(sections(vp + 1))
+    for vp in sorted(points):
+        plugin.scan_lines(vw, start, vp, deadline=float("inf"))
+        prefixes.append((sections(vp), Cache.sectional_view(vp)[1]))
+    plugin.scan_lines(vw, start, vw.size() + 1, deadline=float("inf"))
+    return {"symbol_level": [*Cache.views["symbol_level"]], 
+            "line_start": [*Cache.line_index(vw).line_start], 
+            "balloon": balloons, 
+            "sectional_view": prefixes}
+
+
+def closed_rows(Cache):
+    closed = Cache.views["closed"]
+    return ([*Cache.views["scanned_point"]], [*closed.shutter], 
+            [(tr[base:base + closed.WIDTH], fl[base:base + closed.WIDTH])  
+                for tr, fl, base in map(closed.rows, range(len(closed)))])
+
+
+def verify_large(plugin, vw, seed):
+    # large file mode (levels from the text, closing data per chunk) == the default, 
+    # with chunks small enough that balloons jumping around evict them
+    Cache = plugin.Cache
+    Const = sys.modules["SymbolBalloon.sub.containers"].Const
+    points = random.Random(seed).sample(range(vw.size()), 30)
+    Cache.clear()
+    Cache.query_init(vw)
+    if not Cache.views["symbol_point"]:
+        return []
+    eager = snapshot(plugin, vw, points)
+
+    saved = {k: sublime.SETTINGS.get(k)  for k in ("large_file_symbols", "large_file_chunks")}
+    sublime.SETTINGS.update(large_file_symbols=0, large_file_chunks=1)
+    chunk, Const.LAZY_CHUNK = Const.LAZY_CHUNK, 4
+    try:
+        Cache.clear()
+        Cache.query_init(vw)
+        lazy = snapshot(plugin, vw, points)
+        if not Cache.views.get("lazy"):
+            return ["large_file not entered"]
+        if not Cache.views["closed"].evictions:
+            return ["large_file nothing evicted"]
+    finally:
+        sublime.SETTINGS.update(saved)
+        Const.LAZY_CHUNK = chunk
+    return [f"large_file {name}"  for name in eager if lazy[name] != eager[name]]
+
+
+def verify_patch(plugin, vw, seed, count=6):
+    # edits through on_text_changed, then query_init patches: equal to a fresh build
+    Cache = plugin.Cache
+    rnd = random.Random(seed)
+    Cache.clear()
+    Cache.query_init(vw)
+    if not Cache.views["symbol_point"]:
+        return []
+    plugin.scan_lines(vw, Cache.views["symbol_point"][0], vw.size() + 1, deadline=float("inf"))
+    Cache.line_index(vw)
+
+    for _ in range(count):
+        line = vw.full_line(rnd.randrange(vw.size()))
+        r = rnd.random()
+        if r < 0.4:
+            vw.replace(line.begin(), line.end(), "")
+        elif r < 0.8:
+            copied = vw.substr(vw.full_line(rnd.randrange(vw.size())))
+            vw.replace(line.begin(), line.begin(), copied)
+        else:
+            pt = rnd.randrange(line.begin(), line.end())
+            vw.replace(pt, pt, "x")
+
+    if not Cache.entries.peek(vw.buffer_id()).get("edits"):
+        return ["patch edits not recorded"]
+    points = sorted(rnd.sample(range(vw.size()), 10))
+    Cache.query_init(vw)
+    if Cache.views.get("lines") is None:
+        return ["patch line_index not patched"]
+    patched = snapshot(plugin, vw, points)
+    patched_rows = closed_rows(Cache)
+
+    Cache.clear()
+    Cache.query_init(vw)
+    fresh = snapshot(plugin, vw, points)
+    mismatches = [f"patch {name}"  for name in fresh if patched[name] != fresh[name]]
+    if patched_rows != closed_rows(Cache):
+        mismatches.append("patch closed")
+    return mismatches
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(setups, operation):
+    # setups: iterable of argument tuples, prepared outside the timer.  
+    # api_calls of the first API_SAMPLE, which bench_view keeps the same.
+    times, calls = [], []
+    for args in setups:
+        sublime.CALLS.clear()
+        t0 = time.perf_counter()
+        operation(*args)
+        times.append(time.perf_counter() - t0)
+        calls.append(sum(sublime.CALLS.values()))
+    return {"p50_ms": round(percentile(times, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(times, 0.95) * 1000, 3),
+            "api_calls": round(statistics.mean(calls[:API_SAMPLE]), 1)}
+
+
+def bench_view(plugin, vw, repeat, seed, pool, workers):
+    Cache = plugin.Cache
+    size = vw.size()
+    rnd = random.Random(seed)
+    points = [*sorted(rnd.sample(range(size), API_SAMPLE)), 
+              *sorted(rnd.sample(range(size), max(repeat - API_SAMPLE, 0)))]
+    repeat = len(points)
+    results = {}
+
+    def cold():
+        Cache.clear()
+        Cache.query_init(vw)
+
+    def cold_at(vp):
+        cold()
+        return (vp, )
+
+    results["query_init"] = measure(((Cache.clear() or vw, )  for _ in range(repeat)), 
+                                    Cache.query_init)
+
+    cold()
+    sym_pts = Cache.views["symbol_point"]
+    if not sym_pts:
+        return results
+
+    results["scan_lines"] = measure(
+            (cold_at(vp)  for vp in points), 
+            lambda vp: plugin.scan_lines(vw, Cache.views["symbol_point"][0], vp, 
+                                         deadline=float("inf")))
+
+    cold()
+    plugin.scan_lines(vw, sym_pts[0], size + 1, deadline=float("inf"))
+    results["sectional_view"] = measure(((vp, )  for vp in points), Cache.sectional_view)
+
+    outline = plugin.MiniOutlineCommand(vw)
+
+    def mini_outline(vp):
+        plugin.MOCmd.fragments.clear()
+        outline.do(vp, "symbol", True)
+
+    results["MOCmd.do"] = measure(((vp, )  for vp in points), mini_outline)
+
+    goto = plugin.GotoSymbolWithFilterCommand(vw)
+
+    def goto_symbol(vp):
+        vw.sel()[:] = [sublime.Region(vp)]
+        goto.run(None)
+
+    results["GSWFCmd.run"] = measure(((vp, )  for vp in points), goto_symbol)
+
+    if not vw.scope_name(0).startswith("source"):
+        return results
+
+    # whole buffer, against scan_lines with an unlimited deadline
+    engine = sys.modules["SymbolBalloon.sub.engine"]
+    inputs = engine_inputs(vw, Cache)
+    text, tab_size, pts, lvls, spans, chars = inputs
+    nexts = [*pts[1:], len(text)]
+
+    def full_scan():
+        Cache.clear()
+        Cache.query_init(vw)
+        plugin.scan_lines(vw, pts[0], size + 1, deadline=float("inf"))
+
+    runs = max(repeat // 4, 1)
+    results["scan_lines.all"] = measure((()  for _ in range(runs)), full_scan)
+    results["engine.serial"] = measure((()  for _ in range(runs)), lambda: engine.scan_text(
+                                                text, tab_size, pts, nexts, lvls, spans, chars))
+    results["engine.pool"] = measure((()  for _ in range(runs)), lambda: engine.scan_parallel(
+                                                *inputs, pool, workers))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # ([more API calls], [slower p95, advisory])
+    regressions, slower = [], []
+    for key, ops in results.items():
+        for op, now in ops.items():
+            then = baseline.get(key, {}).get(op)
+            if then is None:
+                continue
+            if now["api_calls"] > then["api_calls"]:
+                regressions.append(f"{key} {op}: api_calls {then['api_calls']} -> {now['api_calls']}")
+            # ignore sub-millisecond noise
+            if now["p95_ms"] > then["p95_ms"] * tolerance + 1.0:
+                slower.append(f"{key} {op}: p95 {then['p95_ms']}ms -> {now['p95_ms']}ms")
+    return (regressions, slower)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,50000", 
+                        help="comma separated line counts (up to 200000)")
+    parser.add_argument("--languages", default=",".join(corpora.LANGUAGES))
+    parser.add_argument("--repeat", type=int, default=API_SAMPLE, 
+                        help=f"timed runs per operation, at least {API_SAMPLE}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--tolerance", type=float, default=1.5, 
+                        help="p95 ratio against the baseline reported as slower")
+    parser.add_argument("--update", action="store_true", help="write the baseline")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, 
+                        help="processes of the engine pool")
+    args = parser.parse_args()
+
+    plugin = load_package()
+    pool = concurrent.futures.ProcessPoolExecutor(args.workers)
+    results = {}
+    mismatches = []
+    print(f"{'corpus':<16}{'operation':<16}{'p50 ms':>10}{'p95 ms':>10}{'api calls':>12}")
+    for language in args.languages.split(","):
+        for lines in map(int, args.sizes.split(",")):
+            text = corpora.generate(language, lines, args.seed)
+            vw = sublime.View(text, syntax=language)
+            key = f"{language}/{lines}"
+            results[key] = bench_view(plugin, vw, args.repeat, args.seed, pool, args.workers)
+            if vw.scope_name(0).startswith("source"):
+                mismatches.extend(f"{key} {name}"  
+                                  for name in verify_engine(plugin, vw, pool, args.workers))
+            mismatches.extend(f"{key} {name}"  for name in verify_large(plugin, vw, args.seed))
+            # last, edits the corpus
+            mismatches.extend(f"{key} {name}"  for name in verify_patch(plugin, vw, args.seed))
+            for op, r in results[key].items():
+                print(f"{key:<16}{op:<16}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}"
+                      f"{r['api_calls']:>12}")
+
+    pool.shutdown()
+    for line in mismatches:
+        print("MISMATCH", line)
+    if mismatches:
+        return 1
+
+    if args.update:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline, run with --update")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions, slower = compare(results, json.load(f), args.tolerance)
+    for line in slower:
+        print("slower (timing, not checked)", line)
+    for line in regressions:
+        print("REGRESSION", line)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
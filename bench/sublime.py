@@ -0,0 +1,542 @@
+# Stand-in for the parts of the Sublime Text API used by SymbolBalloon.
+# Views are backed by a plain string and a few regexes per syntax, and
+# every API method counts its calls in CALLS.
+import re
+import bisect
+import math
+import html
+import json
+import collections
+import functools as ftools
+
+HOVER_TEXT = 1
+HOVER_GUTTER = 2
+HOVER_MARGIN = 3
+LAYOUT_INLINE = 0
+LAYOUT_BELOW = 1
+LAYOUT_BLOCK = 2
+DRAW_NO_FILL = 32
+MONOSPACE_FONT = 1
+KIND_ID_TYPE = 3
+KIND_ID_FUNCTION = 5
+KIND_ID_MARKUP = 9
+
+CALLS = collections.Counter()
+PENDING = collections.deque()
+
+
+def counted(fn):
+    @ftools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        CALLS[fn.__name__] += 1
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def set_timeout(callback, delay=0):
+    PENDING.append(callback)
+
+
+def set_timeout_async(callback, delay=0):
+    PENDING.append(callback)
+
+
+def run_pending(limit=100000):
+    for _ in range(limit):
+        if not PENDING:
+            return
+        PENDING.popleft()()
+
+
+def cache_path():
+    return "/tmp/SymbolBalloonBench/Cache"
+
+
+def packages_path():
+    return "/tmp/SymbolBalloonBench/Packages"
+
+
+class Settings(dict):
+
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def add_on_change(self, tag, callback):
+        pass
+
+    def clear_on_change(self, tag):
+        pass
+
+
+SETTINGS = Settings()
+
+
+def load_settings(name):
+    return SETTINGS
+
+
+def read_settings(path):
+    # sublime-settings allow // comments and trailing commas
+    with open(path, encoding="utf-8") as f:
+        text = re.sub(r'^\s*//.*$', '', f.read(), flags=re.MULTILINE)
+    return json.loads(re.sub(r',(\s*[}\]])', r'\1', text))
+
+
+class Region:
+    __slots__ = ("a", "b", "xpos")
+
+    def __init__(self, a, b=None, xpos=-1):
+        self.a = a
+        self.b = a if b is None else b
+        self.xpos = xpos
+
+    def __iter__(self):
+        return iter((self.a, self.b))
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and (self.a, self.b) == (other.a, other.b)
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __repr__(self):
+        return f"Region({self.a}, {self.b})"
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def empty(self):
+        return self.a == self.b
+
+    def to_tuple(self):
+        return (self.a, self.b)
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+
+class SymbolRegion:
+
+    def __init__(self, name, region, syntax, type, kind):
+        self.name = name
+        self.region = region
+        self.syntax = syntax
+        self.type = type
+        self.kind = kind
+
+
+class QuickPanelItem:
+
+    def __init__(self, trigger, details="", annotation="", kind=(0, "", "")):
+        self.trigger = trigger
+        self.details = details
+        self.annotation = annotation
+        self.kind = kind
+
+
+class Phantom:
+
+    def __init__(self, region, content, layout, on_navigate=None):
+        self.region = region
+        self.content = content
+        self.layout = layout
+        self.on_navigate = on_navigate
+
+    def __eq__(self, other):
+        return ((self.region, self.content, self.layout) ==
+                (other.region, other.content, other.layout))
+
+
+class PhantomSet:
+
+    def __init__(self, view, key=""):
+        self.view = view
+        self.key = key
+        self.phantoms = []
+
+    @counted
+    def update(self, phantoms):
+        self.phantoms = list(phantoms)
+        self.view.phantoms[self.key] = [(p.region, p.content)  for p in self.phantoms]
+
+
+class Selection(list):
+
+    def add(self, region):
+        self.append(region if isinstance(region, Region) else Region(region))
+
+
+class Syntax:
+
+    def __init__(self, name, scope):
+        self.name = name
+        self.scope = scope
+
+
+# syntax name --> (root scope, symbol pattern, name group, kind, comment pattern)
+LANGUAGES = {
+    "Python": ("source.python", 
+               r'^[ \t]*(?:async[ \t]+)?(?:def|class)[ \t]+(\w+)', 1, (KIND_ID_FUNCTION, "f", ""),
+               r'#[^\n]*'),
+    "C": ("source.c", 
+          r'^[ \t]*(?:static[ \t]+)?(?:struct|int|void|char)[ \t]+\**(\w+)[ \t]*[({]', 1, 
+          (KIND_ID_FUNCTION, "f", ""), 
+          r'//[^\n]*|/\*.*?\*/'),
+    "Markdown": ("text.html.markdown", r'^(#{1,6})[ \t]+([^\n]*)', 2, (KIND_ID_MARKUP, "#", ""), 
+                 r'<!--.*?-->'),
+    "LaTeX": ("text.tex.latex", 
+              r'^[ \t]*\\(?:part|chapter|section|subsection|subsubsection|paragraph'
+              r'|subparagraph)\*?\{([^}\n]*)\}', 1, (KIND_ID_MARKUP, "#", ""), r'%[^\n]*'),
+}
+PARAMS = r'^[ \t]*(?:async[ \t]+)?(?:def|class|static[ \t]+int|int|void|char|struct)[ \t]+\**\w+[ \t]*(\([^)]*\))'
+
+_ids = iter(range(1, 1 << 30))
+
+
+class Buffer:
+
+    def __init__(self):
+        self.buffer_id = next(_ids)
+        self.views_ = []
+
+    def id(self):
+        return self.buffer_id
+
+    def views(self):
+        return list(self.views_)
+
+    def primary_view(self):
+        return self.views_[0]
+
+
+class Window:
+
+    def __init__(self):
+        self.panels = {}
+        self.quick_panel = None
+        self.commands = []
+
+    def id(self):
+        return 1
+
+    def folders(self):
+        return []
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, 
+                         on_highlight=None, placeholder=""):
+        self.quick_panel = (items, selected_index, on_highlight, on_select)
+
+    def run_command(self, cmd, args=None):
+        self.commands.append((cmd, args))
+
+    def create_output_panel(self, name):
+        panel = self.panels[name] = View("", "Plain Text", window=self)
+        return panel
+
+    def find_output_panel(self, name):
+        return self.panels.get(name)
+
+
+class View:
+
+    def __init__(self, text, syntax="Python", tab_size=4, window=None, file_name=None):
+        self.view_id = next(_ids)
+        self.buffer_ = Buffer()
+        self.buffer_.views_.append(self)
+        self.window_ = window or Window()
+        self.file_name_ = file_name
+        self.syntax_ = Syntax(syntax, LANGUAGES.get(syntax, ("text.plain", ))[0])
+        self.settings_ = Settings(tab_size=tab_size)
+        self.text = text
+        self.counter = 1
+        self.top = 0
+        self.selection = Selection([Region(0)])
+        self.phantoms = {}
+        self.phantom_ids = {}
+        self.regions = {}
+        self.folded = []
+        self.reindex()
+
+        import sublime_plugin
+        for listener in sublime_plugin.TextChangeListener.__subclasses__():
+            if listener.is_applicable(self.buffer_):
+                listener().attach(self.buffer_)
+
+    def reindex(self):
+        self.starts = [0, *(m.end()  for m in re.finditer("\n", self.text))]
+        lang = LANGUAGES.get(self.syntax_.name)
+        self.comments = [] if lang is None else [
+                m.span()  for m in re.finditer(lang[4], self.text, re.DOTALL)]
+        self.params = [m.span(1)  for m in re.finditer(PARAMS, self.text, re.MULTILINE)]
+        self.defs = [(m.start(), m.end())  
+                        for m in re.finditer(PARAMS + r'[^\n]*', self.text, re.MULTILINE)]
+
+    # -- test helpers --
+    def replace(self, a, b, string):
+        self.text = self.text[:a] + string + self.text[b:]
+        self.counter += 1
+        self.reindex()
+        import sublime_plugin
+        change = TextChange(HistoricPosition(a), HistoricPosition(b), string)
+        for listener in sublime_plugin.TextChangeListener.attached:
+            if listener.buffer is self.buffer_:
+                listener.on_text_changed([change])
+
+    def scroll_to_row(self, row):
+        self.top = self.starts[max(0, min(row, len(self.starts) - 1))]
+
+    # -- API --
+    def id(self):
+        return self.view_id
+
+    def buffer_id(self):
+        return self.buffer_.buffer_id
+
+    def buffer(self):
+        return self.buffer_
+
+    def window(self):
+        return self.window_
+
+    def is_valid(self):
+        return True
+
+    def element(self):
+        return None
+
+    def file_name(self):
+        return self.file_name_
+
+    def name(self):
+        return ""
+
+    def is_dirty(self):
+        return False
+
+    def syntax(self):
+        return self.syntax_
+
+    def settings(self):
+        return self.settings_
+
+    def sel(self):
+        return self.selection
+
+    def change_count(self):
+        return self.counter
+
+    @counted
+    def size(self):
+        return len(self.text)
+
+    @counted
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+        return self.text[x:x + 1]
+
+    def _row(self, pt):
+        return bisect.bisect_right(self.starts, pt) - 1
+
+    def _line(self, pt):
+        a = self.starts[self._row(pt)]
+        b = self.text.find("\n", a)
+        return Region(a, len(self.text) if b < 0 else b)
+
+    @counted
+    def line(self, x):
+        if isinstance(x, Region):
+            return Region(self._line(x.begin()).a, self._line(x.end()).b)
+        return self._line(x)
+
+    @counted
+    def full_line(self, x):
+        a, b = (x.begin(), x.end()) if isinstance(x, Region) else (x, x)
+        return Region(self._line(a).a, min(self._line(b).b + 1, len(self.text)))
+
+    @counted
+    def rowcol(self, pt):
+        row = self._row(pt)
+        return (row, pt - self.starts[row])
+
+    @counted
+    def text_point(self, row, col):
+        row = max(0, min(row, len(self.starts) - 1))
+        return min(self.starts[row] + col, len(self.text))
+
+    @counted
+    def scope_name(self, pt):
+        return self.syntax_.scope + " "
+
+    def _scopes(self, label):
+        if "comment" in label:
+            return self.comments
+        if "parameters" in label or "inheritance" in label:
+            return self.params
+        if "meta.function" in label or "meta.class" in label:
+            return self.defs
+        return []
+
+    @counted
+    def match_selector(self, pt, selector):
+        for label in selector.split("|"):
+            spans = self._scopes(label)
+            i = bisect.bisect_right(spans, (pt, math.inf)) - 1
+            if i >= 0 and spans[i][0] <= pt < spans[i][1]:
+                return True
+        return False
+
+    @counted
+    def find_by_selector(self, selector):
+        spans = sorted({span  for label in selector.split("|") for span in self._scopes(label)})
+        return [Region(a, b)  for a, b in spans]
+
+    @counted
+    def indentation_level(self, pt):
+        line = self.text[self._line(pt).a:self._line(pt).b].expandtabs(self.settings_["tab_size"])
+        return (len(line) - len(line.lstrip())) // self.settings_["tab_size"]
+
+    @counted
+    def extract_scope(self, pt):
+        line = self._line(pt)
+        m = re.match(r'#+', self.text[pt:line.b])
+        return Region(pt, pt + (m.end() if m else 0))
+
+    @counted
+    def extract_tokens_with_scopes(self, region):
+        text = self.text[region.a:region.b]
+        m = re.search(r'\{([^}]*)\}', text) or re.search(r'^#+[ \t]+(.*)$', text) 
+        if m is None:
+            return [(region, "text")]
+        a, b = region.a + m.start(1), region.a + m.end(1)
+        return [(Region(region.a, a), "text"), (Region(a, b), "entity.name"), 
+                (Region(b, region.b), "text")]
+
+    @counted
+    def symbol_regions(self):
+        lang = LANGUAGES.get(self.syntax_.name)
+        if lang is None:
+            return []
+        _, pattern, group, kind, _ = lang
+        return [SymbolRegion(m.group(group), Region(*m.span(group)), self.syntax_.name, 1, kind)
+                        for m in re.finditer(pattern, self.text, re.MULTILINE)]
+
+    @counted
+    def export_to_html(self, regions=None, minihtml=False, enclosing_tags=False, 
+                       font_size=True, font_family=True):
+        rgn = regions if isinstance(regions, Region) else regions[0]
+        return f'<span style="color: #ddd">{html.escape(self.text[rgn.begin():rgn.end()])}</span>'
+
+    @counted
+    def visible_region(self):
+        row = self._row(self.top)
+        return Region(self.top, self.starts[min(row + 50, len(self.starts) - 1)])
+
+    @counted
+    def viewport_position(self):
+        return (0.0, self._row(self.top) * 20.0)
+
+    @counted
+    def viewport_extent(self):
+        return (1200.0, 1000.0)
+
+    @counted
+    def text_to_layout(self, pt):
+        return (0.0, self._row(pt) * 20.0)
+
+    @counted
+    def layout_to_text(self, vector):
+        return self.starts[max(0, min(int(vector[1] // 20), len(self.starts) - 1))]
+
+    def line_height(self):
+        return 20.0
+
+    @counted
+    def add_phantom(self, key, region, content, layout, on_navigate=None):
+        self.phantoms.setdefault(key, []).append((region, content))
+        pid = next(_ids)
+        self.phantom_ids[pid] = (key, region)
+        return pid
+
+    def query_phantom(self, pid):
+        return [self.phantom_ids[pid][1]] if pid in self.phantom_ids else []
+
+    def erase_phantoms(self, key):
+        self.phantoms.pop(key, None)
+        self.phantom_ids = {pid: kr  for pid, kr in self.phantom_ids.items() if kr[0] != key}
+
+    def is_popup_visible(self):
+        return False
+
+    def hide_popup(self):
+        pass
+
+    @counted
+    def add_regions(self, key, regions, scope="", icon="", flags=0, annotations=(), 
+                    annotation_color="", on_navigate=None, **kwargs):
+        self.regions[key] = (list(regions), list(annotations))
+
+    def get_regions(self, key):
+        return list(self.regions.get(key, ([], []))[0])
+
+    def erase_regions(self, key):
+        self.regions.pop(key, None)
+
+    def show(self, x, show_surrounds=True, keep_to_left=False, animate=True):
+        pass
+
+    def show_at_center(self, x, animate=True):
+        pass
+
+    @counted
+    def fold(self, regions):
+        self.folded.extend(regions if isinstance(regions, list) else [regions])
+
+    @counted
+    def unfold(self, regions):
+        regions = regions if isinstance(regions, list) else [regions]
+        self.folded = [f  for f in self.folded if not any(r.contains(f)  for r in regions)]
+
+    def folded_regions(self):
+        return list(self.folded)
+
+    def run_command(self, cmd, args=None):
+        import sublime_plugin
+        if cmd == "append":
+            self.text += args["characters"]
+            self.reindex()
+            return
+        for command in sublime_plugin.TextCommand.registry:
+            if command.name() == cmd:
+                return command(self).run(None, **(args or {}))
+
+
+class HistoricPosition:
+
+    def __init__(self, pt):
+        self.pt = pt
+        self.row = self.col = self.col_utf16 = self.col_utf8 = 0
+
+
+class TextChange:
+
+    def __init__(self, a, b, string):
+        self.a = a
+        self.b = b
+        self.str = string
+        self.len_utf16 = len(string.encode("utf-16-le")) // 2
+        self.len_utf8 = len(string.encode("utf-8"))
@@ -0,0 +1,69 @@
+# Stand-in for sublime_plugin: commands register themselves by class name.
+import re
+
+
+def command_name(cls):
+    name = cls.__name__
+    name = name[:-len("Command")] if name.endswith("Command") else name
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+class Command:
+    registry = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Command.registry.append(cls)
+
+    @classmethod
+    def name(cls):
+        return command_name(cls)
+
+
+class TextCommand(Command):
+    registry = Command.registry
+
+    def __init__(self, view):
+        self.view = view
+
+
+class WindowCommand(Command):
+
+    def __init__(self, window):
+        self.window = window
+
+
+class ApplicationCommand(Command):
+    pass
+
+
+class EventListener:
+    pass
+
+
+class ViewEventListener:
+
+    def __init__(self, view):
+        self.view = view
+
+
+class TextChangeListener:
+    attached = []
+
+    def __init__(self):
+        self.buffer = None
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        return True
+
+    def attach(self, buffer):
+        self.buffer = buffer
+        TextChangeListener.attached.append(self)
+
+    def detach(self):
+        TextChangeListener.attached.remove(self)
+        self.buffer = None
+
+    def is_attached(self):
+        return self.buffer is not None
@@ -5,30 +5,49 @@ import itertools as itools
 import operator as opr
 import functools as ftools
 import bisect
+from typing import ClassVar
 
-from .containers import Cache
+from .containers import Cache, LRUCache, Hover, Stats, Presenter
 
 
 class FTOCmd(sublime_plugin.TextCommand):
     # Fold to outline
+    @Stats.command("fold_to_outline")
     def run(self, edit):
 
-        def focus_level(target_level):
-            nonlocal vw, sym_pts, sym_lvls
+        def fold_plan(target_level):
+            # (first symbol line - 1, {(b, a), ...} between the selected symbol lines)
+            nonlocal lines, sym_pts, sym_lvls, size, plans
+
+            if target_level not in plans:
+                selectors = map(opr.le, sym_lvls, itools.repeat(target_level))
+                selected_pts = itools.compress(sym_pts, selectors)
 
-            size = Cache.views["size"]
-            vw.unfold(sublime.Region(0, size))
+                ab = map(opr.methodcaller("to_tuple"), map(lines.line, selected_pts))
+                flat = itools.chain.from_iterable((a - 1, b)  for a, b in ab)
+                a_pt = next(flat, -1)
 
-            selectors = map(opr.le, sym_lvls, itools.repeat(int(target_level)))
-            selected_pts = itools.compress(sym_pts, selectors)
+                bababb = itools.zip_longest(flat, flat, fillvalue=size)
+                plans[target_level] = (a_pt, frozenset(bababb))
+                Cache.account(("derived", "fold_plans"), plans[target_level], grow=True)
+            return plans[target_level]
 
-            ab = map(opr.methodcaller("to_tuple"), map(vw.line, selected_pts))
-            flat = itools.chain.from_iterable((a - 1, b)  for a, b in ab)
-            a_pt = next(flat, -1)
-            
-            bababb = itools.zip_longest(flat, flat, fillvalue=size)
-            ba_rgns = itools.starmap(sublime.Region, bababb)
-            vw.fold(list(ba_rgns))
+        def focus_level(target_level):
+            nonlocal vw, size, folded
+
+            a_pt, plan = fold_plan(int(target_level))
+            if folded is None:
+                vw.unfold(sublime.Region(0, size))
+                folded = frozenset()
+
+            # only the difference to the previously highlighted level
+            unfolds = sorted(folded - plan)
+            folds = sorted(plan - folded)
+            if unfolds:
+                vw.unfold([*itools.starmap(sublime.Region, unfolds)])
+            if folds:
+                vw.fold([*itools.starmap(sublime.Region, folds)])
+            folded = plan
 
             vw.show_at_center(a_pt + 1)
 
@@ -46,6 +65,11 @@ class FTOCmd(sublime_plugin.TextCommand):
             return
 
         sym_lvls = Cache.views["symbol_level"]
+        size = Cache.views["size"]
+        lines = Cache.line_index(vw)
+        plans = Cache.derived("fold_plans", dict)   # level --> fold_plan, per change_count
+        folded = None
+
         lvls = sorted(set(sym_lvls), reverse=True)
         qpitems = [*map(str, lvls)]
         
@@ -64,6 +88,7 @@ class FTOCmd(sublime_plugin.TextCommand):
 
 class GTLSCmd(sublime_plugin.TextCommand):
     # Goto top level symbol
+    @Stats.command("goto_top_level_symbol")
     def run(self, edit):
 
         def focus_symbol(symrgn, word):
@@ -99,36 +124,35 @@ class GTLSCmd(sublime_plugin.TextCommand):
                                     args={"overlay": "goto", "text": "@"})
             return
 
-        zipped = zip(symlvls,
-                     Cache.views["symbol_point"],
-                     Cache.views["symbol_end_point"],
-                     Cache.views["symbol_name"],
-                     itools.zip_longest(*Cache.views["symbol_kind"], fillvalue=""))
-
-        toplvl = min(symlvls)
-        sym_infos = (info  for lvl, *info in zipped if lvl == toplvl)
-
-        symrgns, qpitems = [], []
-        index = itools.count(-1)
+        sym_pts, symrgns, qpitems = self.items(vw)
         tgtpt = vw.sel()[0].begin()
 
-        for a_pt, b_pt, name, kind in sym_infos:
-
-            symrgns.append(sublime.Region(a_pt, b_pt))
-            qpitems.append(sublime.QuickPanelItem(trigger=name, kind=kind))
-            (a_pt <= tgtpt) and next(index)
-
         vw.window().show_quick_panel(
                 items=qpitems, 
                 on_highlight=lambda idx: focus_symbol(symrgns[idx], qpitems[idx].trigger),
                 on_select=lambda idx: commit_symbol(symrgns, idx),
-                selected_index=next(index),
+                selected_index=bisect.bisect_right(sym_pts, tgtpt) - 1,
                 placeholder="Top level")
 
+    @staticmethod
+    def items(view):
+        # (points, regions, QuickPanelItems) of the top level, once per change_count
+
+        def build():
+            symrgns, qpitems = [], []
+            for rec in Cache.records(Cache.top_indices()):
+                symrgns.append(sublime.Region(rec.point, rec.end_point))
+                qpitems.append(sublime.QuickPanelItem(trigger=rec.name, kind=rec.kind))
+            return ([*map(opr.attrgetter("a"), symrgns)], symrgns, qpitems)
+
+        return Cache.derived("goto_top_level_symbol", build)
+
 
 class MOCmd(sublime_plugin.TextCommand):
     # Mini outline
-    def do(self, current_point, mode, completed):
+    fragments: ClassVar[LRUCache] = LRUCache(4096)
+
+    def do(self, current_point, mode, completed, generation=None):
 
         def navigate(href):
             nonlocal vw
@@ -136,71 +160,82 @@ class MOCmd(sublime_plugin.TextCommand):
             vw.show(int(href),
                     show_surrounds=False,
                     keep_to_left=True)
-            vw.erase_regions("MiniOutline")
-
-        def unfold_selector(current_index, symbol_levels):
+            Presenter.clear_annotation(vw, "MiniOutline")
 
-            symcnt = len(symbol_levels)
+        def unfolded(current_index, top_indices):
+            # indices rendered as lines, the rest collapse into fold marks
+            symcnt = len(sym_pts)
             if symcnt < 35:
-                return itools.repeat(True)
+                return range(symcnt)
 
-            toplvl = min(symbol_levels)
-            unfolds = map(opr.eq, symbol_levels, itools.repeat(toplvl))
-            topcnt = symbol_levels.count(toplvl)
+            topcnt = len(top_indices)
             foldcnt = (topcnt - (5 + 1 + 5)) // 2
+            tops = itools.chain(range(min(5, topcnt)), 
+                                [5 + foldcnt] if foldcnt > 0 else [], 
+                                range(5 + 2 * max(foldcnt, 0) + 1 if foldcnt > 0 else 5, topcnt))
 
-            ch = itools.chain(itools.repeat(True, 5), 
-                              itools.repeat((), foldcnt),
-                              [True], 
-                              itools.repeat((), foldcnt), 
-                              itools.repeat(True, 5 + 2))
+            start = max(current_index - 8, 0)
+            surrounds = range(start, min(start + 14, symcnt))
 
-            unfolds = ((istop and next(ch))  for istop in unfolds)
+            return {*surrounds, *map(top_indices.__getitem__, tops)}
 
-            surrounds = itools.chain(itools.repeat(False, current_index - 8), 
-                                     itools.repeat(True, 14), 
-                                     itools.repeat(False, symcnt))
+        def fragment(index):
+            nonlocal vw, mode
+            key = (vw.buffer_id(), vw.change_count(), index, mode)
 
-            return ((srd or uf)  for srd, uf in zip(surrounds, unfolds))
+            def render():
+                pt = sym_pts[index]
+                region = lines.line(pt)
+                end_pt = Cache.views["symbol_end_point"][index]
+                if mode == "symbol" and region.contains(end_pt):
+                    region = sublime.Region(region.a, end_pt)
+                return '<a href="{}">{}</a><br>'.format(pt, to_html(region))
+
+            return MOCmd.fragments.fetch(key, render)
 
         vw = self.view
         sym_pts = Cache.views["symbol_point"]
+        lines = Cache.line_index(vw)
         to_html = ftools.partial(vw.export_to_html, 
                                  minihtml=True, enclosing_tags=False, 
                                  font_size=False, font_family=False)
-        regions = map(vw.line, sym_pts)
-
-        if mode == "symbol":
-            regions = (sublime.Region(line.a, pt) if line.contains(pt) else line  
-                               for line, pt in zip(regions, Cache.views["symbol_end_point"]))
-
-        htmls = map(to_html, regions)
-        hrefs = map('<a href="{}">{}</a><br>'.format, sym_pts, htmls)
 
         visible_symbol, _ = Cache.sectional_view(current_point)
         idx = bisect.bisect_left(sym_pts, current_point)
-        uf_selectors = unfold_selector(idx, Cache.views["symbol_level"])
-        
-        if not visible_symbol:
-            selectors = itools.repeat(False)
-        else:
-            vsrgns = map(opr.attrgetter("region"), visible_symbol.values())
-            rotated = itools.chain(vsrgns, (rgn := next(vsrgns), ))   # repeat False
-            selectors = ((rgn.contains(pt) and (rgn := next(rotated)))  for pt in sym_pts)
-
-        indicated = (f'<div class="indicate">{href}</div>' if sel else (uf and href)
-                                for href, sel, uf in zip(hrefs, selectors, uf_selectors))
-
-        arrowed = itools.chain(itools.islice(indicated, idx), 
-                               ['<div class="arrow"></div>'], 
-                               indicated)
 
-        dct = {True: ['<div class="topfold"></div>'],
-               False: ['<div class="foldline"></div>']}
-
-        grp = itools.groupby(arrowed, key=bool)
-        folded = itools.chain.from_iterable(itr if bln else dct[() in itr] 
-                                                            for bln, itr in grp)
+        top_indices = Cache.top_indices()
+
+        indicated = set()
+        lo = 0
+        for rgn in map(opr.attrgetter("region"), visible_symbol.values()):
+            lo = bisect.bisect_left(sym_pts, rgn.begin(), lo)
+            if lo == len(sym_pts) or not rgn.contains(sym_pts[lo]):
+                break
+            indicated.add(lo)
+            lo += 1
+
+        def foldmark(start, stop):
+            nonlocal top_indices
+            if bisect.bisect_left(top_indices, start) < bisect.bisect_left(top_indices, stop):
+                return '<div class="topfold"></div>'
+            return '<div class="foldline"></div>'
+
+        events = sorted([*((i, 1)  for i in {*unfolded(idx, top_indices), *indicated}), 
+                         (idx, 0)])
+        folded = []
+        nxt = 0
+        for pos, is_item in events:
+            if nxt < pos:
+                folded.append(foldmark(nxt, pos))
+            if not is_item:
+                folded.append('<div class="arrow"></div>')
+                nxt = pos
+                continue
+            href = fragment(pos)
+            folded.append(f'<div class="indicate">{href}</div>' if pos in indicated else href)
+            nxt = pos + 1
+        if nxt < len(sym_pts):
+            folded.append(foldmark(nxt, len(sym_pts)))
 
         color = "var(--greenish)" if completed else "var(--redish)"
         astyle = 'a{text-decoration: none; font-size: 0.9rem;}'
@@ -225,16 +260,14 @@ class MOCmd(sublime_plugin.TextCommand):
                     f'<div style="margin: 0.3rem 0.8rem">{"".join(folded)}</div>'
                 '</body>')
 
-        vw.erase_regions("MiniOutline")
-        vw.add_regions(key="MiniOutline", 
-                       regions=[sublime.Region(current_point)], 
-                       annotations=[con],
-                       annotation_color="#36c",
-                       on_navigate=navigate)
+        if generation is not None and not Hover.is_newest(vw, generation):
+            return
+        Presenter.annotation(vw, "MiniOutline", current_point, con, "#36c", navigate)
 
 
 class GSWFCmd(sublime_plugin.TextCommand):
     # Goto symbol with filter
+    @Stats.command("goto_symbol_with_filter")
     def run(self, edit):
 
         def focus_symbol(symrgn, word):
@@ -270,29 +303,31 @@ class GSWFCmd(sublime_plugin.TextCommand):
                                     args={"overlay": "goto", "text": "@"})
             return
 
-        zipped = zip(symlvls,
-                     Cache.views["symbol_point"],
-                     Cache.views["symbol_end_point"],
-                     Cache.views["symbol_name"],
-                     itools.zip_longest(*Cache.views["symbol_kind"], fillvalue=""))
-
-        symrgns, qpitems = [], []
-        index = itools.count(-1)
+        symrgns, qpitems = self.items(vw)
         tgtpt = vw.sel()[0].begin()
 
-        for lvl, a_pt, b_pt, name, kind in zipped:
-
-            symrgns.append(sublime.Region(a_pt, b_pt))
-            trg = ("  " * lvl + name).ljust(35) + "   " + str(lvl) + ";" + kind[1]
-            qpitems.append(sublime.QuickPanelItem(trigger=trg, 
-                                                  kind=kind,
-                                                  annotation=str(vw.rowcol(a_pt)[0] + 1)))
-            (a_pt <= tgtpt) and next(index)
-
         vw.window().show_quick_panel(
                 items=qpitems, 
                 on_highlight=lambda idx: focus_symbol(symrgns[idx], qpitems[idx].trigger[:-3]),
                 on_select=lambda idx: commit_symbol(symrgns, idx),
-                selected_index=next(index),
+                selected_index=bisect.bisect_right(Cache.views["symbol_point"], tgtpt) - 1,
                 placeholder="",
                 flags=sublime.MONOSPACE_FONT)
+
+    @staticmethod
+    def items(view):
+        # (regions, QuickPanelItems) of all symbols, once per change_count
+
+        def build():
+            lines = Cache.line_index(view)
+            symrgns, qpitems = [], []
+            for rec in Cache.records():
+                symrgns.append(sublime.Region(rec.point, rec.end_point))
+                trg = (("  " * rec.level + rec.name).ljust(35) + 
+                                    "   " + str(rec.level) + ";" + rec.kind[1])
+                qpitems.append(sublime.QuickPanelItem(trigger=trg, 
+                                                      kind=rec.kind,
+                                                      annotation=str(lines.row(rec.point) + 1)))
+            return (symrgns, qpitems)
+
+        return Cache.derived("goto_symbol_with_filter", build)
@@ -1,19 +1,41 @@
 import sublime
 
 import itertools as itools
+import functools as ftools
 import operator as opr
 import collections
 import dataclasses as dcls
 import bisect
 import array
+import re
+import sys
+import time
+import threading
 from typing import ClassVar
 
+from .engine import IndentProfile, Intervals, IgnoredIndex, indentation_levels
+
 
 @dcls.dataclass(init=False, eq=False, frozen=True)
 class Const:
 
     KEY_ID: ClassVar[str] = "SymbolBalloon"
 
+    PARAM_SELECTOR: ClassVar[str] = ("meta.function.parameters | meta.class.parameters "
+                                     "| meta.class.inheritance | meta.method.parameters")
+    DEF_SELECTOR: ClassVar[str] = "meta.function | meta.class | meta.section.latex"
+
+    SCAN_SLICE: ClassVar[float] = 0.015   # sec
+    SCAN_INTERVAL: ClassVar[int] = 5      # ms
+    SCAN_CHUNK: ClassVar[int] = 64        # symbols
+    SCAN_ROWS: ClassVar[int] = 4096       # rows between deadline checks
+    REBUILD_DELAY: ClassVar[int] = 100    # ms after the last modification
+    PREBUILD_DELAY: ClassVar[int] = 500   # ms after the last modification
+    FOLLOW_INTERVAL: ClassVar[int] = 50   # ms between viewport polls
+    LAZY_CHUNK: ClassVar[int] = 1024      # symbols per chunk of the large file mode
+
+    STATS_SPANS: ClassVar[int] = 4096     # ring size of instrumentation
+
 
 class Pkg:
 
@@ -26,81 +48,725 @@ class Pkg:
             cls.settings.add_on_change(Const.KEY_ID, cls.init_settings)
 
 
-class ChainMapEx(collections.ChainMap):
+class LRUCache(collections.OrderedDict):
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def fetch(self, key, factory):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+
+        value = self[key] = factory()
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+        return value
+
+
+class ViewCache:
+    # buffer_id --> index dict in LRU order, bounded by an estimated byte budget
+
+    def __init__(self):
+        self.entries = collections.OrderedDict()
+        self.sizes = {}     # buffer_id --> {field: bytes}
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def peek(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+    def pop(self, key):
+        self.sizes.pop(key, None)
+        return self.entries.pop(key, None)
+
+    def resize(self, key, budget):
+        # measure a whole entry, then shrink
+        self.sizes[key] = {field: self.measure(value)  
+                                for field, value in self.entries[key].items()}
+        self.shrink(budget)
+
+    def account(self, key, field, nbytes, budget):
+        # a cache attached to the entry after resize, then shrink
+        self.sizes.setdefault(key, {})[field] = nbytes
+        self.shrink(budget)
+
+    def shrink(self, budget):
+        # evict the largest of the least recently used quarter until within budget
+        total = sum(map(self.size, self.entries))
+
+        while total > budget and len(self.entries) > 1:
+            olds = itools.islice(self.entries, max((len(self.entries) - 1) // 4, 1))
+            victim = max(olds, key=self.size)
+            total -= self.size(victim)
+            self.pop(victim)
+            self.evictions += 1
+
+    def size(self, key):
+        return sum(self.sizes.get(key, {}).values())
+
+    @classmethod
+    def measure(cls, value, seen=None):
+        # bytes reachable through dicts, sequences and plain objects (QuickPanelItem), 
+        # objects with their own __sizeof__ (arrays, tables, indices) count themselves
+        seen = set() if seen is None else seen
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            return size + sum(cls.measure(v, seen)  for item in value.items() for v in item)
+        if isinstance(value, (tuple, list, set, frozenset)):
+            return size + sum(cls.measure(v, seen)  for v in value)
+        if type(value).__sizeof__ is object.__sizeof__ and hasattr(value, "__dict__"):
+            return size + cls.measure(vars(value), seen)
+        return size
+
+
+class NameTable:
+    # names[i] = blob[offsets[i]:offsets[i + 1]]
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, names=()):
+        names = list(names)
+        self.blob = "".join(names)
+        self.offsets = array.array("I", itools.accumulate(map(len, names), initial=0))
 
-    def appendflat(self, mapping):
-        self.maps.append(mapping)     # setdefault
-        self.maps = [dict(self.items())]
+    def __len__(self):
+        return len(self.offsets) - 1
 
-    def limit_filter(self, limit):
-        return ChainMapEx({k: v  for k, v in self.items() if v < limit})
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [*map(self.__getitem__, range(*index.indices(len(self))))]
+        if index < 0:
+            index += len(self)
+        return self.blob[self.offsets[index]:self.offsets[index + 1]]
 
-    def fill(self, stop):
-        # {3: 44, 1: 77}.fill(6) --> {2: -1, 3: 44, 4: -1, 5: -1, 1: 77}
-        dct = {i: -1  for i in range(min(self, default=99) + 1, stop)}
-        cm = ChainMapEx(self)
-        cm.appendflat(dct)
-        return cm
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
 
-    def move_to_child(self, pred, init_factory):
-        dq = collections.deque(self.maps[:50], maxlen=50)
-        # or None
-        if not any(pred(dq[0]) or dq.rotate()  for _ in range(len(dq))):
-            dq.appendleft(init_factory())
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.blob) + sys.getsizeof(self.offsets)
 
-        self.maps = list(dq)
 
+class KindTable:
+    # kinds[index[i]] = (kind_id, letter, "")   interned
+    __slots__ = ("kinds", "index")
 
-@dcls.dataclass(eq=False)
-class Closed:
-    # true.maps = [{indentation_level: min(points), ...}]   no parents
-    true: ChainMapEx = dcls.field(default_factory=ChainMapEx)
-    false: ChainMapEx = dcls.field(default_factory=ChainMapEx)
+    def __init__(self, kinds=()):
+        interned = {}
+        self.index = array.array("H", (interned.setdefault(k, len(interned))  for k in kinds))
+        self.kinds = tuple(interned)
 
-    def appendflat(self, closed):
-        self.true.appendflat(closed.true)
-        self.false.appendflat(closed.false)
+    def __len__(self):
+        return len(self.index)
 
-    def cut(self, visible_point):
-        cm_t = self.true.limit_filter(visible_point)
-        cm_f = self.false.limit_filter(visible_point)
+    def __getitem__(self, index):
+        return self.kinds[self.index[index]]
+
+    def __iter__(self):
+        return map(self.kinds.__getitem__, self.index)
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sys.getsizeof(self.index) + 
+                sys.getsizeof(self.kinds) + sum(map(sys.getsizeof, self.kinds)))
+
+
+class SymbolRecord:
+    __slots__ = ("index", "level", "point", "end_point", "name", "kind")
+
+    def __init__(self, entry, index):
+        self.index = index
+        self.level = entry["symbol_level"][index]
+        self.point = entry["symbol_point"][index]
+        self.end_point = entry["symbol_end_point"][index]
+        self.name = entry["symbol_name"][index]
+        self.kind = entry["symbol_kind"][index]
+
+
+class ClosedStore:
+    # true[symbol_index * WIDTH + indentation_level] = min(points)   -1: not closed
+    # shutter[symbol_index] = min(closed indentation_level)
+    WIDTH: ClassVar[int] = 16
+
+    def __init__(self):
+        self.true = array.array("i")
+        self.false = array.array("i")
+        self.shutter = array.array("B")
+        self.tree = None    # min segment tree over shutter, built on demand
+        self.epoch = 0      # scans so far, LazyClosedStore keeps the chunks of the current one
+
+    def __len__(self):
+        return len(self.shutter)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(map(sys.getsizeof, 
+                                                 (self.true, self.false, self.shutter, self.tree)))
+
+    def append(self, level, point):
+        blank = array.array("i", [-1]) * self.WIDTH
+        self.true.extend(blank)
+        self.false.extend(blank)
+        self.shutter.append(99)
+        self.tree = None
+        self.record(len(self.shutter) - 1, {level + 1: point}, {})
+
+    def append_shifted(self, other, index, shift):
+        row = slice(index * self.WIDTH, (index + 1) * self.WIDTH)
+        self.true.extend(pt if pt < 0 else shift(pt)  for pt in other.true[row])
+        self.false.extend(pt if pt < 0 else shift(pt)  for pt in other.false[row])
+        self.shutter.append(other.shutter[index])
+        self.tree = None
+
+    def rows(self, index):
+        # (true, false, offset of index in them)
+        return (self.true, self.false, index * self.WIDTH)
+
+    def resident(self):
+        # rows() of the symbols held in memory
+        return map(self.rows, range(len(self.shutter)))
+
+    def pin(self, start, stop):
+        # keep the rows of symbols start..stop for the current scan, all are kept here
+        pass
+
+    def set_shutter(self, index, level):
+        self.shutter[index] = level
+        if self.tree is not None:
+            i = index + len(self.tree) // 2
+            self.tree[i] = level
+            while (i := i >> 1):
+                self.tree[i] = min(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def record(self, index, true, false):
+        # setdefault, levels beyond WIDTH share the last slot
+        tr, fl, base = self.rows(index)
+        last = self.WIDTH - 1
+        for arr, dct in ((tr, true), (fl, false)):
+            for lvl, pt in dct.items():
+                i = base + min(lvl, last)
+                if arr[i] < 0:
+                    arr[i] = pt
+        if true and min(true) < self.shutter[index]:
+            self.set_shutter(index, min(min(true), last))
+
+    def min_shutter(self, start, stop):
+        # min(shutter[start:stop])
+        if self.tree is None:
+            size = 1 << max(len(self.shutter) - 1, 0).bit_length()
+            tree = array.array("B", [99]) * size + self.shutter
+            tree.extend(array.array("B", [99]) * (size - len(self.shutter)))
+            for i in range(size - 1, 0, -1):
+                tree[i] = min(tree[2 * i], tree[2 * i + 1])
+            self.tree = tree
+
+        tree, res = self.tree, 99
+        lo, hi = start + len(tree) // 2, stop + len(tree) // 2
+        while lo < hi:
+            if lo & 1:
+                res = min(res, tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                res = min(res, tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return res
+
+    def cut(self, index, visible_point):
+        # (shutter below visible_point, ignoredpt)
+        tr, fl, base = self.rows(index)
+        row = range(base, base + self.WIDTH)
+        idt_t = next((i - row.start  for i in row if -1 < tr[i] < visible_point), 99)
+        idt_f = next((i - row.start  for i in row if -1 < fl[i] < visible_point), 99)
 
         ignoredpt = None
-        if (idt := min(cm_f, default=99)) < min(cm_t, default=99):
-            ignoredpt = cm_f[idt]
+        if idt_f < idt_t:
+            ignoredpt = fl[row.start + idt_f]
+
+        return (idt_t, ignoredpt)
+
+
+class LazyClosedStore(ClosedStore):
+    # true/false per chunk of symbols, made on first use.  Over budget the coldest chunk 
+    # not used by the current scan is dropped, its symbols return to unscanned.
+    def __init__(self, points, levels, scanned, done, chunk, budget):
+        super().__init__()
+        last = self.WIDTH - 1
+        self.points = points
+        self.levels = levels
+        self.scanned = scanned
+        self.done = done
+        self.chunk = chunk
+        self.budget = budget
+        self.shutter = array.array("B", (min(lvl + 1, last)  for lvl in levels))
+        self.chunks = collections.OrderedDict()    # number --> [true, false, epoch]
+        self.evictions = 0
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sys.getsizeof(self.shutter) + sys.getsizeof(self.tree) + 
+                sum(sys.getsizeof(tr) + sys.getsizeof(fl)  for tr, fl, _ in self.chunks.values()))
+
+    def span(self, number):
+        return range(number * self.chunk, min((number + 1) * self.chunk, len(self.shutter)))
 
-        return (Closed(cm_t, cm_f), ignoredpt)
+    def rows(self, index):
+        number, i = divmod(index, self.chunk)
+        if number in self.chunks:
+            self.chunks.move_to_end(number)
+        else:
+            self.chunks[number] = [*self.materialize(number), self.epoch]
+            while len(self.chunks) > self.budget:
+                coldest = next(iter(self.chunks))
+                if self.chunks[coldest][2] == self.epoch:
+                    break
+                self.evict(coldest)
+        chunk = self.chunks[number]
+        chunk[2] = self.epoch
+        return (chunk[0], chunk[1], i * self.WIDTH)
 
+    def resident(self):
+        return ((tr, fl, i * self.WIDTH)  for tr, fl, _ in self.chunks.values() 
+                                            for i in range(len(tr) // self.WIDTH))
 
-class Cache:
-    # views.maps = [{init_dct}, {init_dct}, ...]  masked parents 
-    views: ClassVar[ChainMapEx] = ChainMapEx({"id": -1, "change_counter": -1})
+    def pin(self, start, stop):
+        # the scan skips done symbols without rows(), their chunks must not look cold
+        first, last = start // self.chunk, (stop - 1) // self.chunk
+        for number in [n  for n in self.chunks if first <= n <= last]:
+            self.chunks[number][2] = self.epoch
+            self.chunks.move_to_end(number)
+
+    def materialize(self, number):
+        # what append(level, point) records for each symbol
+        span, last = self.span(number), self.WIDTH - 1
+        tr = array.array("i", [-1]) * (len(span) * self.WIDTH)
+        fl = array.array("i", tr)
+        for i, idx in enumerate(span):
+            tr[i * self.WIDTH + min(self.levels[idx] + 1, last)] = self.points[idx]
+        return (tr, fl)
+
+    def evict(self, number):
+        del self.chunks[number]
+        last = self.WIDTH - 1
+        for idx in self.span(number):
+            self.scanned[idx] = self.points[idx]
+            self.done[idx] = 0
+            self.set_shutter(idx, min(self.levels[idx] + 1, last))
+        self.evictions += 1
+
+
+class LineIndex:
+    # line_start[row] of a text of length, patched with the recorded edits
+    __slots__ = ("line_start", "length", "change_count")
+    MAX_EDITS: ClassVar[int] = 64   # more edits: cheaper to rebuild
+
+    def __init__(self, line_start, length, change_count):
+        self.line_start = line_start
+        self.length = length
+        self.change_count = change_count
+
+    @classmethod
+    def from_text(cls, text, change_count):
+        lines = text.split("\n")
+        starts = itools.accumulate(map(len, lines), lambda acc, ln: acc + ln + 1, initial=0)
+        return cls(array.array("i", itools.islice(starts, len(lines))), len(text), change_count)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.line_start)
+
+    def patched(self, line_edits, change_count, length):
+        # line_edits = [(a, b, inserted length, newline offsets in it), ...]  or None
+        if line_edits is None or len(line_edits) > self.MAX_EDITS:
+            return None
+        starts, size = self.line_start, self.length
+        for a, b, n, newlines in line_edits:
+            # starts in (a, b] lost their newline, later ones move by the length change
+            i, j = bisect.bisect_right(starts, a), bisect.bisect_right(starts, b)
+            delta = n - (b - a)
+            tail = starts[j:] if delta == 0 else array.array("i", map(delta.__add__, starts[j:]))
+            starts = starts[:i] + array.array("i", (a + k + 1  for k in newlines)) + tail
+            size += delta
+        return LineIndex(starts, size, change_count) if size == length else None
+
+    def row(self, point):
+        return bisect.bisect_right(self.line_start, point) - 1
+
+    def rowcol(self, point):
+        row = self.row(point)
+        return (row, point - self.line_start[row])
+
+    def text_point(self, row, col):
+        row = max(min(row, len(self.line_start) - 1), 0)
+        return min(self.line_start[row] + col, self.length)
+
+    def full_line(self, point):
+        row = self.row(point)
+        end = self.line_start[row + 1] if row + 1 < len(self.line_start) else self.length
+        return sublime.Region(self.line_start[row], end)
+
+    def line(self, point):
+        row = self.row(point)
+        end = self.line_start[row + 1] - 1 if row + 1 < len(self.line_start) else self.length
+        return sublime.Region(self.line_start[row], end)
+
+
+class SignatureIndex:
+    # symbol_end_point --> parameter region, escaped tooltips per (symbol_end_point, tab_size)
+    REACH: ClassVar[int] = 1500
+
+    def __init__(self, params, defs, change_count):
+        self.params = Intervals(map(opr.methodcaller("to_tuple"), params))
+        self.defs = Intervals(map(opr.methodcaller("to_tuple"), defs))
+        self.change_count = change_count
+        self.regions = {}
+        self.tooltips = {}
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sys.getsizeof(self.params) + 
+                sys.getsizeof(self.defs) + sys.getsizeof(self.regions) + 
+                sum(map(sys.getsizeof, self.tooltips.values())))
+
+    def region(self, end_point):
+        if (rgn := self.regions.get(end_point)) is not None:
+            return rgn
+
+        # first point where params == defs, then up to the end of params
+        limit = end_point + self.REACH
+        pt = end_point
+        while pt < limit:
+            (prm, prm_next), (dfn, dfn_next) = self.params.span(pt), self.defs.span(pt)
+            if prm == dfn:
+                break
+            pt = min(prm_next, dfn_next)
+        start = min(pt, limit)
+
+        pt = start + 1
+        while pt < limit:
+            prm, prm_next = self.params.span(pt)
+            if not prm:
+                break
+            pt = prm_next
+        end = min(pt, limit)
+
+        rgn = self.regions[end_point] = (start, end)
+        return rgn
+
+
+class Headings:
+    # syntax --> {regex: level}  the lowest level found in a heading line wins
+    TABLES: ClassVar[dict] = {
+        "Markdown": {f"^ {{0,3}}#{{{n}}}(?!#)": n  for n in range(1, 7)},
+        "LaTeX": {rf"\\{title}(?![A-Za-z])": lvl  for lvl, title in enumerate((
+                    "part", "chapter", "section", "subsection", 
+                    "subsubsection", "paragraph", "subparagraph"))},
+    }
+    DEFAULT: ClassVar[int] = 9
+    patterns: ClassVar[LRUCache] = LRUCache(16)
+
+    @classmethod
+    def table(cls, syntax):
+        tables = {**cls.TABLES, **Pkg.settings.get("heading_levels", {})}
+        if syntax in tables:
+            return tables[syntax]
+        return tables["LaTeX"] if "LaTeX" in syntax else None
+
+    @classmethod
+    def classifier(cls, view, table):
+        # one substr of the view and one alternation for all heading lines
+
+        def compile_table():
+            ranked = sorted(table.items(), key=opr.itemgetter(1))
+            alternation = "|".join(f"(?P<h{i}>{pat})"  for i, (pat, _) in enumerate(ranked))
+            return (re.compile(alternation, re.MULTILINE), 
+                    [(f"h{i}", lvl)  for i, (_, lvl) in enumerate(ranked)])
+
+        pattern, groups = cls.patterns.fetch(tuple(sorted(table.items())), compile_table)
+        text = view.substr(sublime.Region(0, view.size()))
+
+        def heading_level(point):
+            a = text.rfind("\n", 0, point) + 1
+            b = text.find("\n", point)
+            found = (next(lvl  for name, lvl in groups if m.group(name) is not None)
+                            for m in pattern.finditer(text, a, len(text) if b < 0 else b))
+            return min(found, default=cls.DEFAULT)
+
+        return heading_level
+
+
+class Hover:
+    # newest hover generation per view
+    generations: ClassVar[dict] = {}
+
+    @classmethod
+    def advance(cls, view):
+        generation = cls.generations[view.id()] = cls.generations.get(view.id(), 0) + 1
+        return generation
+
+    @classmethod
+    def is_newest(cls, view, generation):
+        return cls.generations.get(view.id()) == generation
+
+    @staticmethod
+    def layout(view):
+        # measured on every settled hover, a fold moves the text under an unchanged viewport
+        _, vis = view.text_to_layout(view.visible_region().begin())
+        lh = view.line_height()
+        _, viewport = view.viewport_extent()
+        curr = view.layout_to_text((0, vis + max(lh, viewport * 0.13)))
+        tgt = view.layout_to_text((0, vis + viewport * 0.18))
+        return (vis, lh, viewport, curr, tgt)
+
+
+class Presenter:
+    # phantoms (a PhantomSet) and annotation regions per (view, key), 
+    # an update with the same markup and anchor is skipped, a moved one reuses the markup.  
+    # anchor = (point, change_count), an edit may have moved or deleted what is shown
+    phantoms: ClassVar[dict] = {}       # (view.id(), key) --> (PhantomSet, hash(markup), anchor)
+    annotations: ClassVar[dict] = {}    # (view.id(), key) --> (hash(markup), anchor)
+    counters: ClassVar[collections.Counter] = collections.Counter()
+
+    @classmethod
+    def outcome(cls, view, shown, digest, anchor):
+        # "skipped", "moved" or "rendered"
+        if shown is not None and shown[0] == digest:
+            result = "skipped" if shown[1] == anchor else "moved"
+        else:
+            result = "rendered"
+        cls.counters[result] += 1
+        Stats.count(view, "present." + result)
+        return result
+
+    @classmethod
+    def phantom(cls, view, key, point, markup, on_navigate, layout=sublime.LAYOUT_BELOW):
+        slot, digest, anchor = (view.id(), key), hash(markup), (point, view.change_count())
+        pset, *shown = cls.phantoms.get(slot, (None, ))
+        if cls.outcome(view, shown or None, digest, anchor) == "skipped":
+            return
+        if pset is None:
+            pset = sublime.PhantomSet(view, key)
+        pset.update([sublime.Phantom(sublime.Region(point), markup, layout, on_navigate)])
+        cls.phantoms[slot] = (pset, digest, anchor)
+
+    @classmethod
+    def annotation(cls, view, key, point, markup, color, on_navigate):
+        slot, digest, anchor = (view.id(), key), hash(markup), (point, view.change_count())
+        shown = cls.annotations.get(slot)
+        if not view.get_regions(key):
+            shown = None    # erased elsewhere
+        if cls.outcome(view, shown, digest, anchor) == "skipped":
+            return
+        # add_regions replaces the region of key, no erase in between
+        view.add_regions(key, [sublime.Region(point)], 
+                         annotations=[markup], 
+                         annotation_color=color,
+                         on_navigate=on_navigate)
+        cls.annotations[slot] = (digest, anchor)
+
+    @classmethod
+    def clear_annotation(cls, view, key):
+        cls.annotations.pop((view.id(), key), None)
+        if view.get_regions(key):
+            view.erase_regions(key)
+
+    @classmethod
+    def clear(cls, view, key):
+        pset, *_ = cls.phantoms.pop((view.id(), key), (None, ))
+        if pset is not None:
+            pset.update([])
+        cls.clear_annotation(view, key)
+
+    @classmethod
+    def forget(cls, view):
+        for dct in (cls.phantoms, cls.annotations):
+            for slot in [slot  for slot in dct if slot[0] == view.id()]:
+                del dct[slot]
+
+
+class APICounter:
+    # view proxy counting its method calls as "api.<name>" on the thread of the command, 
+    # a plain pass-through once closed
+    __slots__ = ("view", "bid", "counter", "thread")
+
+    def __init__(self, view, counter):
+        self.view = view
+        self.bid = view.buffer_id()
+        self.counter = counter
+        self.thread = threading.get_ident()
+
+    def buffer_id(self):
+        return self.bid
+
+    def close(self):
+        # callbacks and PhantomSets made by the command keep the proxy
+        self.counter = None
+
+    def __getattr__(self, name):
+        attr = getattr(self.view, name)
+        if not callable(attr) or self.counter is None:
+            return attr
+
+        def counted(*args, **kwargs):
+            counter = self.counter
+            if counter is not None and threading.get_ident() == self.thread:
+                counter["api." + name] += 1
+            return attr(*args, **kwargs)
+
+        return counted
+
+
+class Stats:
+    # Opt-in ("instrumentation": true) timings and counters.
+    # spans = ring of (buffer_id, name, sec)   totals: buffer_id --> Counter
+    spans: ClassVar[collections.deque] = collections.deque(maxlen=Const.STATS_SPANS)
+    totals: ClassVar[collections.defaultdict] = collections.defaultdict(collections.Counter)
+
+    @staticmethod
+    def on():
+        return Pkg.settings is not None and Pkg.settings.get("instrumentation", False)
+
+    @classmethod
+    def count(cls, view, key, n=1):
+        if cls.on():
+            cls.totals[view.buffer_id()][key] += n
+
+    @classmethod
+    def stopwatch(cls, view, prefix):
+        # lap(name) records the time since the previous lap as "prefix/name"
+        if not cls.on():
+            return lambda name: None
+        bid, last = view.buffer_id(), [time.perf_counter()]
+
+        def lap(name):
+            now = time.perf_counter()
+            cls.spans.append((bid, f"{prefix}/{name}", now - last[0]))
+            last[0] = now
+
+        return lap
+
+    @classmethod
+    def command(cls, name):
+        # times TextCommand.run and counts the API calls made through self.view
+        def decorator(run):
+
+            @ftools.wraps(run)
+            def _command_(self, *args, **kwargs):
+                if not cls.on():
+                    return run(self, *args, **kwargs)
+                view = self.view
+                self.view = proxy = APICounter(view, cls.totals[view.buffer_id()])
+                t0 = time.perf_counter()
+                try:
+                    return run(self, *args, **kwargs)
+                finally:
+                    proxy.close()
+                    self.view = view
+                    cls.spans.append((view.buffer_id(), name, time.perf_counter() - t0))
+                    cls.totals[view.buffer_id()][name] += 1
+
+            return _command_
+        return decorator
+
+    @classmethod
+    def percentiles(cls):
+        # [(name, count, p50, p95, max), ...]  in sec
+        by_name = collections.defaultdict(list)
+        for _, name, sec in cls.spans:
+            by_name[name].append(sec)
+        pick = lambda secs, q: secs[min(int(q * len(secs)), len(secs) - 1)]
+        rows = []
+        for name, secs in sorted(by_name.items()):
+            secs.sort()
+            rows.append((name, len(secs), pick(secs, 0.5), pick(secs, 0.95), secs[-1]))
+        return rows
+
+    @classmethod
+    def export(cls):
+        return {"spans": [*map(list, cls.spans)],
+                "totals": {str(bid): dict(cnt)  for bid, cnt in cls.totals.items()},
+                "view_cache": {"hits": Cache.entries.hits, "misses": Cache.entries.misses, 
+                               "evictions": Cache.entries.evictions},
+                "presenter": dict(Presenter.counters),
+                "max_scan_ms": Pkg.settings.get("max_scan_ms", 20)}
+
+    @classmethod
+    def clear(cls):
+        cls.spans.clear()
+        cls.totals.clear()
+        Presenter.counters.clear()
+
+
+class TextDelta:
+    # edits = [(a, b, inserted_length), ...]  in order of arrival
+
+    @staticmethod
+    def shift(point, edits):
+        for a, b, n in edits:
+            if b <= point:
+                point += n - (b - a)
+            elif a < point:
+                return None     # swallowed by the edit
+        return point
+
+    @staticmethod
+    def span(edits):
+        # dirty (lo, hi) in current coordinates
+        lo, hi = edits[0][0], -1
+        for a, b, n in edits:
+            if b <= hi:
+                hi += n - (b - a)
+            elif a < hi:
+                hi = a + n
+            lo, hi = min(lo, a), max(hi, a + n)
+        return (lo, hi)
+
+    @staticmethod
+    def length(size, edits):
+        # text length after the edits
+        return size + sum(n - (b - a)  for a, b, n in edits)
+
+
+class PerThread(type):
+    # Cache.views of the calling thread, the async thread cannot swap a command's entry
+
+    @property
+    def views(cls):
+        if not hasattr(cls.local, "views"):
+            cls.local.views = {"id": -1, "change_counter": -1}
+        return cls.local.views
+
+    @views.setter
+    def views(cls, entry):
+        cls.local.views = entry
+
+
+class Cache(metaclass=PerThread):
+    # views = entries[view.buffer_id()]  the last queried by this thread
+    #   entries are built outside the lock and swapped in whole by publish()
+    local: ClassVar[threading.local] = threading.local()
+    entries: ClassVar[ViewCache] = ViewCache()
+    lock: ClassVar[object] = threading.RLock()
+    generations: ClassVar[itools.count] = itools.count(1)
 
     @classmethod
     def query_init(cls, view):
 
-        def init_dct():
-
-            def heading_level(point):
-                nonlocal view, syntax
-
-                if syntax == "Markdown":
-                    pt = view.line(point).begin()
-                    return view.extract_scope(pt).end() - pt
-
-                elif "LaTeX" in syntax:
-                    titledct = {"\\part": 0, "\\chapter": 1, "\\section": 2, "\\subsection": 3,
-                                "\\subsubsection": 4, "\\paragraph": 5, "\\subparagraph": 6}
-                    symline = view.substr(view.line(point)).lstrip()
-                    lvl = 0
-                    for title, lvl in titledct.items():
-                        if title in symline:
-                            break
-                    else:
-                        lvl = 9
-                    return lvl
-                else:
-                    return view.indentation_level(point)
+        def init_dct(prev=None):
 
             nonlocal view
             syntax = view.syntax().name
@@ -108,53 +774,337 @@ class Cache:
 
             ignr_symscope = Pkg.settings.get("ignored_symbols", {}).get(syntax, "")
 
-            level = view.indentation_level if is_source else heading_level
+            table = None if is_source else Headings.table(syntax)
             sr = view.symbol_regions()
             
             if sr is None:
-                return {"id": view.id(), "change_counter": -1,
+                return {"id": view.buffer_id(), "change_counter": -1,
                         "symbol_point": (), "symbol_level": ()}
             elif sr == []:
-                return {"id": view.id(), "change_counter": view.change_count(), 
+                return {"id": view.buffer_id(), "change_counter": view.change_count(), 
                         "symbol_point": (), "symbol_level": ()}
 
+            size = view.size()
+            lazy = (len(sr) > Pkg.settings.get("large_file_symbols", 50000) or 
+                    size > Pkg.settings.get("large_file_mb", 16) * 1024 * 1024)
+
             tpls = map(opr.attrgetter("name", "region", "kind"), sr)
             if ignr_symscope:                    
                 tpls = (tpl  for tpl in tpls  
                                 if not view.match_selector(tpl[1].begin(), ignr_symscope))
 
             names, regions, kinds = zip(*tpls)
-            a_pts, b_pts = zip(*regions)
-            ids, letters, _ = zip(*kinds)
+            a_pts, b_pts = (array.array("Q", pts)  for pts in zip(*regions))
+            names = NameTable(names)
+            kinds = KindTable((kid, letter, "")  for kid, letter, _ in kinds)
+
+            if lazy:
+                # levels from the text at once, closing data per chunk on demand
+                if table is None:
+                    levels = indentation_levels(view.substr(sublime.Region(0, size)), 
+                                                int(view.settings().get('tab_size', 8)), a_pts)
+                else:
+                    levels = array.array("B", map(Headings.classifier(view, table), a_pts))
+                scanned, done = array.array("Q", a_pts), bytearray(len(a_pts))
+                budget = Pkg.settings.get("large_file_chunks", 64)
+                closes = LazyClosedStore(a_pts, levels, scanned, done, Const.LAZY_CHUNK, budget)
+
+            else:
+                level = (view.indentation_level if table is None else 
+                                    Headings.classifier(view, table))
+
+                # an edit recorded twice (built before on_text_changed ran) does not add up
+                if (prev is None or prev.get("lazy") or 
+                                TextDelta.length(prev["size"], prev["edits"]) != size):
+                    levels = array.array("B", map(level, a_pts))
 
-            levels = array.array("B", map(level, a_pts))
+                    closes = ClosedStore()
+                    for lvl, pt in zip(levels, a_pts):
+                        closes.append(lvl, pt)
+                    scanned = array.array("Q", a_pts)
+                else:
+                    levels, scanned, closes = cls.patch(view, prev, a_pts, level)
+                done = bytearray(len(a_pts))
+            parents = cls.enclosing(levels)
 
-            dcts = ({lvl + 1: pt}  for lvl, pt in zip(levels, a_pts))
-            closes = map(Closed, map(ChainMapEx, dcts))
-            # closed.false=ChainMapEx({})
+            lines = None if prev is None else prev.get("lines")
+            if lines is not None and lines.change_count == prev["change_counter"]:
+                lines = lines.patched(prev.get("line_edits"), view.change_count(), size)
+            else:
+                lines = None
             
             return {
-                "id": view.id(),
-                "symbol_point": tuple(a_pts),
-                "symbol_end_point": tuple(b_pts),
-                "scanned_point": list(a_pts),
+                "id": view.buffer_id(),
+                "symbol_point": a_pts,
+                "symbol_end_point": b_pts,
+                "scanned_point": scanned,
+                "scan_done": done,
                 "symbol_level": levels,
-                "symbol_name": tuple(names),
-                "closed": list(closes),
-                "symbol_kind": (array.array("B", ids), tuple(letters), ("", )),
+                "symbol_parent": parents,
+                "symbol_name": names,
+                "closed": closes,
+                "symbol_kind": kinds,
 
-                "size": view.size(),
+                "size": size,
                 "change_counter": view.change_count(),
+                "edits": [],
+                "line_edits": [],
+                "lines": lines,
+                "scan_cursor": 0,
+                "scan_completed": False,
+                "persisted": False,
+                "derived": {},
+                "lazy": lazy,
+                "scan_lock": threading.RLock(),
             }
 
-        cls.views.move_to_child(lambda dct: dct["id"] == view.id(), init_dct)
+        key = view.buffer_id()
+        change_count = view.change_count()
+        with cls.lock:
+            cls.views = cls.entries.get(key)
+
+        if cls.views is None:
+            Stats.count(view, "cache.miss")
+            cls.views = cls.publish(view, None, init_dct(), change_count)
 
-        if cls.views["change_counter"] != view.change_count():
-            cls.views.update(init_dct())
+        elif cls.views["change_counter"] != change_count:
+            prev = cls.views
+            Stats.count(view, "cache.patch" if prev.get("edits") else "cache.rebuild")
+            cls.views = cls.publish(view, prev, init_dct(prev if prev.get("edits") else None), 
+                                    change_count)
             return True
-            
+
+        else:
+            Stats.count(view, "cache.hit")
         return False
 
+    @classmethod
+    def publish(cls, view, prev, entry, change_count):
+        # entry replaces prev unless an edit, a close, a clear or another thread came first
+        with cls.lock:
+            current = cls.entries.peek(view.buffer_id())
+            if (current is prev and view.change_count() == change_count and 
+                                            (prev is not None or view.is_valid())):
+                cls.adopt(view, entry)
+                return entry
+            Stats.count(view, "cache.discarded")
+            if current is not None and current["change_counter"] == view.change_count():
+                return current
+            return entry
+
+    @classmethod
+    def adopt(cls, view, entry):
+        with cls.lock:
+            entry["generation"] = next(cls.generations)
+            cls.entries.put(view.buffer_id(), entry)
+            cls.entries.resize(view.buffer_id(), 
+                               Pkg.settings.get("cache_budget_mb", 256) * 1024 * 1024)
+
+    @classmethod
+    def forget(cls, view):
+        with cls.lock:
+            if cls.entries.pop(view.buffer_id()) is cls.views:
+                cls.views = {"id": -1, "change_counter": -1}
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.entries = ViewCache()
+            cls.views = {"id": -1, "change_counter": -1}
+
+    @staticmethod
+    def enclosing(levels):
+        # parent = the nearest preceding symbol of a lower level, -1 at the top
+        parents = array.array("i")
+        stack = []
+        for i, lvl in enumerate(levels):
+            while stack and levels[stack[-1]] >= lvl:
+                stack.pop()
+            parents.append(stack[-1] if stack else -1)
+            stack.append(i)
+        return parents
+
+    @classmethod
+    def patch(cls, view, prev, symbol_points, level):
+        # Reuse levels and finished scans of the symbols the edits did not touch.
+        edits = prev["edits"]
+        shift = ftools.partial(TextDelta.shift, edits=edits)
+        lo, hi = TextDelta.span(edits)
+        lo, hi = view.line(lo).begin(), view.full_line(hi).end()
+
+        olds = {shift(pt): i  for i, pt in enumerate(prev["symbol_point"])}
+        olds.pop(None, None)
+
+        levels = array.array("B")
+        scanned, closes = array.array("Q"), ClosedStore()
+        for pt in symbol_points:
+            i = olds.get(pt)
+            outside = pt < lo or hi <= pt
+            lvl = prev["symbol_level"][i] if i is not None and outside else level(pt)
+            levels.append(lvl)
+
+            scanpt = None if i is None else shift(prev["scanned_point"][i])
+            if scanpt is not None and (hi <= pt or scanpt < lo):
+                scanned.append(scanpt)
+                closes.append_shifted(prev["closed"], i, shift)
+            else:
+                scanned.append(pt)
+                closes.append(lvl, pt)
+
+        return (levels, scanned, closes)
+
+    @classmethod
+    def records(cls, indices=None):
+        if indices is None:
+            indices = range(len(cls.views["symbol_point"]))
+        return map(ftools.partial(SymbolRecord, cls.views), indices)
+
+    @classmethod
+    def top_indices(cls):
+        symlvls = cls.views["symbol_level"]
+        return cls.derived("top_indices", lambda: array.array("i", 
+                            itools.compress(itools.count(), map(opr.eq, symlvls, 
+                                                        itools.repeat(min(symlvls))))))
+
+    @classmethod
+    def memory_report(cls):
+        # [(field, packed bytes, bytes of the tuple/ChainMap layout), ...]
+        entry = cls.views
+        ints = lambda seq: sys.getsizeof(tuple(seq)) + sum(map(sys.getsizeof, seq))
+        closed = entry["closed"]
+        width = closed.WIDTH
+
+        def legacy_closed():
+            # list of Closed(true=ChainMapEx({...}), false=ChainMapEx({...}))
+            holder = type("Closed", (), {})()
+            holder.true = holder.false = chainmap = collections.ChainMap()
+            per_symbol = (sys.getsizeof(holder) + sys.getsizeof(vars(holder)) + 2 * (
+                    sys.getsizeof(chainmap) + sys.getsizeof(vars(chainmap)) + sys.getsizeof([{}])))
+
+            total = sys.getsizeof([None] * len(closed)) + per_symbol * len(closed)
+            for tr, fl, base in closed.resident():
+                for arr in (tr, fl):
+                    dct = {lvl: pt  for lvl, pt in enumerate(arr[base:base + width]) if pt >= 0}
+                    total += sys.getsizeof(dct) + sum(map(sys.getsizeof, dct.values()))
+            return total
+
+        names = [*entry["symbol_name"]]
+        kinds = entry["symbol_kind"]
+        return [
+            ("symbol_point", sys.getsizeof(entry["symbol_point"]), ints(entry["symbol_point"])),
+            ("symbol_end_point", sys.getsizeof(entry["symbol_end_point"]), 
+                                 ints(entry["symbol_end_point"])),
+            ("scanned_point", sys.getsizeof(entry["scanned_point"]) +     # with scan_done
+                              sys.getsizeof(entry["scan_done"]), ints(entry["scanned_point"])),
+            ("symbol_level", sys.getsizeof(entry["symbol_level"]), 
+                             sys.getsizeof(entry["symbol_level"])),
+            ("symbol_name", sys.getsizeof(entry["symbol_name"]), 
+                            sys.getsizeof(tuple(names)) + sum(map(sys.getsizeof, names))),
+            ("symbol_kind", sys.getsizeof(kinds), 
+                            sys.getsizeof(array.array("B", map(opr.itemgetter(0), kinds))) + 
+                            sys.getsizeof(tuple(map(opr.itemgetter(1), kinds)))),
+            ("closed", sys.getsizeof(closed), legacy_closed()),
+        ]
+
+    @classmethod
+    def derived(cls, key, factory):
+        # values of the current change_count, dropped by query_init
+        dct = cls.views.setdefault("derived", {})
+        if key not in dct:
+            dct[key] = factory()
+            cls.account(("derived", key), dct[key])
+        return dct[key]
+
+    @classmethod
+    def account(cls, field, value, grow=False):
+        # count a cache attached to the current entry after adopt(), grow: value was added to it
+        entry = cls.views
+        nbytes = ViewCache.measure(value)
+        with cls.lock:
+            if cls.entries.peek(entry["id"]) is not entry:
+                return
+            if grow:
+                nbytes += cls.entries.sizes.get(entry["id"], {}).get(field, 0)
+            cls.entries.account(entry["id"], field, nbytes, 
+                                Pkg.settings.get("cache_budget_mb", 256) * 1024 * 1024)
+
+    @classmethod
+    def indent_profile(cls, view):
+        tabsize = int(view.settings().get('tab_size', 8))
+        profile = cls.views.get("profile")
+
+        if (profile is None or profile.tab_size != tabsize or 
+                                profile.change_count != view.change_count()):
+            text = view.substr(sublime.Region(0, view.size()))
+            profile = IndentProfile(text, tabsize, view.change_count())
+            lines = cls.views.get("lines")
+            if lines is None or lines.change_count != view.change_count():
+                cls.views["lines"] = LineIndex(profile.line_start, len(text), view.change_count())
+                cls.account("lines", cls.views["lines"])
+            Stats.count(view, "cache.miss.profile")
+            cls.views["profile"] = profile
+            cls.account("profile", profile)
+
+        return profile
+
+    @classmethod
+    def line_index(cls, view):
+        lines = cls.views.get("lines")
+
+        if lines is None or lines.change_count != view.change_count():
+            lines = LineIndex.from_text(view.substr(sublime.Region(0, view.size())), 
+                                        view.change_count())
+            Stats.count(view, "cache.miss.lines")
+            cls.views["lines"] = lines
+            cls.account("lines", lines)
+
+        return lines
+
+    @classmethod
+    def ignored_index(cls, view, profile):
+        chars = Pkg.settings.get("ignored_characters", "")
+        scope = Pkg.settings.get("ignored_scope", "_")
+        index = cls.views.get("ignored")
+
+        if (index is None or index.characters != chars or index.selector != scope or 
+                                        index.change_count != view.change_count()):
+            index = IgnoredIndex(map(opr.methodcaller("to_tuple"), view.find_by_selector(scope)), 
+                                 profile.head, chars, scope, view.change_count())
+            Stats.count(view, "cache.miss.ignored")
+            cls.views["ignored"] = index
+            cls.account("ignored", index)
+
+        return index
+
+    @classmethod
+    def signature_index(cls, view):
+        index = cls.views.get("signature")
+
+        if index is None or index.change_count != view.change_count():
+            index = SignatureIndex(view.find_by_selector(Const.PARAM_SELECTOR), 
+                                   view.find_by_selector(Const.DEF_SELECTOR), 
+                                   view.change_count())
+            Stats.count(view, "cache.miss.signature")
+            cls.views["signature"] = index
+            cls.account("signature", index)
+
+        return index
+
+    @classmethod
+    def record_changes(cls, buffer, changes):
+        with cls.lock:
+            dct = cls.entries.peek(buffer.id())
+            if dct is not None and "edits" in dct:
+                dct["edits"].extend((ch.a.pt, ch.b.pt, len(ch.str))  for ch in changes)
+                if len(dct["edits"]) > 1000:
+                    del dct["edits"]    # cheaper to rebuild
+            if dct is not None and "line_edits" in dct:
+                dct["line_edits"].extend((ch.a.pt, ch.b.pt, len(ch.str), 
+                            [i  for i, c in enumerate(ch.str) if c == "\n"] if "\n" in ch.str else ())
+                                                                        for ch in changes)
+                if len(dct["line_edits"]) > LineIndex.MAX_EDITS:
+                    del dct["line_edits"]
+
     @classmethod
     def sectional_view(cls, visible_point):
 
@@ -167,31 +1117,26 @@ class Cache:
         if idx < 0:
             return ({}, None)
 
-        reverse = slice(idx, None, -1)
-        idtlvls = cls.views["symbol_level"][reverse]
-        toplvl = min(idtlvls)
-        stopper = range(idtlvls.index(toplvl) + 1)
-
-        sym_infos = zip(cls.views["symbol_name"][reverse],
-                        cls.views["symbol_point"][reverse],
-                        cls.views["symbol_end_point"][reverse])
-        closes = cls.views["closed"][reverse]
+        levels = cls.views["symbol_level"]
+        closes = cls.views["closed"]
         if not closes:
             return ({}, None)
 
-        sym_dcts = ({idt: info}  for idt, info, _ in zip(idtlvls, sym_infos, stopper))
-
-        section, ignoredpt = closes[0].cut(visible_point)
-        closes[0] = section
-        shutters = (cl.true.fill(15)  for cl in closes)
+        shutter, ignoredpt = closes.cut(idx, visible_point)
+        visible_idx = {}
 
-        hiding = itools.chain.from_iterable(zip(shutters, sym_dcts))
+        parents = cls.views["symbol_parent"]
+        i = idx
+        while i >= 0:
+            if levels[i] < shutter:
+                visible_idx[levels[i]] = i
+            parent = parents[i]
+            if parent >= 0:
+                shutter = min(shutter, closes.min_shutter(parent, i))
+            i = parent
 
-        visible_idtlvl = dict(ChainMapEx(*hiding))
-        visible_symbol = {idt: to_symbol_region(info)
-                            for idt, info in visible_idtlvl.items()
-                                        if not isinstance(info, int)}
-        idtlvls = sorted(visible_symbol)
-        visible_symbol = {idt: visible_symbol[idt]  for idt in idtlvls}
+        infos = opr.itemgetter("symbol_name", "symbol_point", "symbol_end_point")
+        visible_symbol = {idt: to_symbol_region([seq[i]  for seq in infos(cls.views)])
+                                for idt, i in sorted(visible_idx.items())}
         
-        return (visible_symbol, ignoredpt)
\ No newline at end of file
+        return (visible_symbol, ignoredpt)
@@ -0,0 +1,195 @@
+import sublime
+
+import os
+import json
+import array
+import struct
+import hashlib
+import threading
+from typing import ClassVar
+
+from .containers import Pkg, Cache, ClosedStore, NameTable, KindTable, Headings
+
+
+class DiskCache:
+    # <cache_path>/SymbolBalloon/<md5(file_name)>.sbidx
+    #   MAGIC, len(header), json header, arrays in ARRAYS order, name blob
+    MAGIC: ClassVar[bytes] = b"SBIDX2\n"
+    ARRAYS: ClassVar[tuple] = (("symbol_point", "Q"), ("symbol_end_point", "Q"), 
+                               ("scanned_point", "Q"), ("symbol_level", "B"), 
+                               ("name_offset", "I"), ("kind_index", "H"), 
+                               ("true", "i"), ("false", "i"), ("shutter", "B"))
+    MAX_FILES: ClassVar[int] = 200
+
+    @staticmethod
+    def directory():
+        return os.path.join(sublime.cache_path(), "SymbolBalloon")
+
+    @classmethod
+    def location(cls, file_name):
+        digest = hashlib.md5(file_name.encode("utf-8", "surrogatepass")).hexdigest()
+        return os.path.join(cls.directory(), digest + ".sbidx")
+
+    @staticmethod
+    def fingerprint(view):
+        syntax = view.syntax().name
+        return json.dumps([syntax, 
+                           int(view.settings().get('tab_size', 8)),
+                           Pkg.settings.get("ignored_characters", ""),
+                           Pkg.settings.get("ignored_scope", "_"),
+                           Pkg.settings.get("ignored_symbols", {}).get(syntax, ""),
+                           Headings.table(syntax)])
+
+    @staticmethod
+    def digest(view):
+        text = view.substr(sublime.Region(0, view.size()))
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+    @staticmethod
+    def usable(view):
+        return (Pkg.settings.get("persistent_cache", False) and 
+                            view.file_name() is not None and not view.is_dirty())
+
+    @classmethod
+    def store(cls, view):
+        entry = Cache.entries.peek(view.buffer_id())
+        if (not cls.usable(view) or entry is None or not entry.get("scan_completed") or 
+                                        entry["change_counter"] != view.change_count()):
+            return
+        try:
+            stat = os.stat(view.file_name())
+        except OSError:
+            return
+        if entry.get("persisted") == stat.st_mtime_ns:
+            return    # a plain save changes mtime and is written again
+
+        closed, names, kinds = entry["closed"], entry["symbol_name"], entry["symbol_kind"]
+        arrays = {"symbol_point": entry["symbol_point"],
+                  "symbol_end_point": entry["symbol_end_point"],
+                  "scanned_point": entry["scanned_point"],
+                  "symbol_level": entry["symbol_level"],
+                  "name_offset": names.offsets, "kind_index": kinds.index,
+                  "true": closed.true, "false": closed.false, "shutter": closed.shutter}
+        blob = names.blob.encode("utf-8", "surrogatepass")
+
+        header = json.dumps({
+            "file_name": view.file_name(),
+            "file_size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "size": entry["size"],
+            "digest": cls.digest(view),
+            "fingerprint": cls.fingerprint(view),
+            "count": len(entry["symbol_point"]),
+            "arrays": [len(arrays[name])  for name, _ in cls.ARRAYS],
+            "blob": len(blob),
+            "kinds": kinds.kinds,
+        }).encode()
+
+        os.makedirs(cls.directory(), exist_ok=True)
+        path = cls.location(view.file_name())
+        with open(path + ".tmp", "wb") as f:
+            f.write(cls.MAGIC + struct.pack("<I", len(header)) + header)
+            for name, typecode in cls.ARRAYS:
+                arrays[name].tofile(f)
+            f.write(blob)
+        os.replace(path + ".tmp", path)
+
+        entry["persisted"] = stat.st_mtime_ns
+        cls.prune()
+
+    @classmethod
+    def restore(cls, view):
+        # True when a valid index was put into Cache.entries
+        if not cls.usable(view) or Cache.entries.peek(view.buffer_id()) is not None:
+            return False
+        try:
+            stat = os.stat(view.file_name())
+            with open(cls.location(view.file_name()), "rb") as f:
+                data = memoryview(f.read())
+        except OSError:
+            return False
+
+        try:
+            header, arrays, blob = cls.parse(data)
+            if (header["file_name"] != view.file_name() or header["file_size"] != stat.st_size or 
+                    header["mtime"] != stat.st_mtime_ns or header["size"] != view.size() or 
+                    header["fingerprint"] != cls.fingerprint(view) or 
+                    header["digest"] != cls.digest(view)):
+                return False
+        except (ValueError, KeyError, TypeError, IndexError, struct.error):
+            return False    # foreign, truncated or corrupt
+
+        names, kinds, closed = NameTable(), KindTable(), ClosedStore()
+        names.blob = blob
+        names.offsets = arrays["name_offset"]
+        kinds.kinds = header["kinds"]
+        kinds.index = arrays["kind_index"]
+        closed.true, closed.false, closed.shutter = arrays["true"], arrays["false"], arrays["shutter"]
+        count = header["count"]
+
+        parents = Cache.enclosing(arrays["symbol_level"])
+        Cache.adopt(view, {
+            "id": view.buffer_id(),
+            "symbol_point": arrays["symbol_point"],
+            "symbol_end_point": arrays["symbol_end_point"],
+            "scanned_point": arrays["scanned_point"],
+            "scan_done": bytearray(b"\x01") * count,
+            "symbol_level": arrays["symbol_level"],
+            "symbol_parent": parents,
+            "symbol_name": names,
+            "closed": closed,
+            "symbol_kind": kinds,
+
+            "size": view.size(),
+            "change_counter": view.change_count(),
+            "edits": [],
+            "scan_cursor": count,
+            "scan_completed": True,
+            "persisted": header["mtime"],
+            "derived": {},
+            "scan_lock": threading.RLock(),
+        })
+        return True
+
+    @classmethod
+    def parse(cls, data):
+        # (header, {name: array}, name blob), every length checked against the symbol count
+        pos = len(cls.MAGIC)
+        if data[:pos] != cls.MAGIC:
+            raise ValueError("magic")
+        (hlen, ) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        header = json.loads(bytes(data[pos:pos + hlen]))
+        pos += hlen
+
+        count = header["count"]
+        lengths = {"true": count * ClosedStore.WIDTH, "false": count * ClosedStore.WIDTH, 
+                   "name_offset": count + 1}
+        arrays = {}
+        for (name, typecode), length in zip(cls.ARRAYS, header["arrays"]):
+            if length != lengths.get(name, count):
+                raise ValueError(name)
+            arr = arrays[name] = array.array(typecode)
+            nbytes = length * arr.itemsize
+            arr.frombytes(data[pos:pos + nbytes])
+            pos += nbytes
+        blob = str(data[pos:pos + header["blob"]], "utf-8", "surrogatepass")
+        header["kinds"] = tuple(map(tuple, header["kinds"]))
+
+        if (count == 0 or len(arrays) != len(cls.ARRAYS) or 
+                any(len(arrays[name]) != lengths.get(name, count)  for name in arrays) or 
+                pos + header["blob"] != len(data) or len(blob) != arrays["name_offset"][-1] or 
+                max(arrays["kind_index"]) >= len(header["kinds"])):
+            raise ValueError("lengths")
+        return (header, arrays, blob)
+
+    @classmethod
+    def prune(cls):
+        with os.scandir(cls.directory()) as it:
+            files = sorted((e  for e in it if e.name.endswith(".sbidx")), 
+                           key=lambda e: e.stat().st_mtime, reverse=True)
+        for e in files[cls.MAX_FILES:]:
+            try:
+                os.remove(e.path)
+            except OSError:
+                pass
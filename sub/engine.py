@@ -0,0 +1,213 @@
+# Scanning without a view: buffer text, tab size, symbol points and ignored spans in, 
+# scanned_point and closed levels out.  No sublime import, everything here pickles, 
+# so a process pool can scan parts of a large buffer.  Text is a str, UTF-8 bytes or a 
+# memoryview of them are decoded by the entry points; points count characters as in a view.
+import itertools as itools
+import operator as opr
+import bisect
+import array
+import math
+import sys
+from typing import ClassVar
+
+
+class IndentProfile:
+    # per line: line_start, first non-blank (level, offset, head)   blank: level 255
+    BLANK: ClassVar[int] = 255
+
+    def __init__(self, text, tab_size, change_count):
+        self.tab_size = tab_size
+        self.change_count = change_count
+
+        lines = text.split("\n")
+        starts = itools.accumulate(map(len, lines), lambda acc, ln: acc + ln + 1, initial=0)
+        self.line_start = array.array("i", itools.islice(starts, len(lines)))
+        self.level = array.array("B")
+        self.offset = array.array("i")
+        heads = []
+
+        for line in lines:
+            stripped = line.lstrip()
+            if not stripped:
+                self.level.append(self.BLANK)
+                self.offset.append(0)
+                heads.append(" ")
+                continue
+            width = len(line) - len(stripped)
+            col = len(line[:width].expandtabs(tab_size))
+            self.level.append(min(math.ceil(col / tab_size), self.BLANK - 1))
+            self.offset.append(width)
+            heads.append(stripped[0])
+
+        self.head = "".join(heads)
+
+        # min segment tree over levels
+        self.size = 1 << max(len(lines) - 1, 0).bit_length()
+        tree = array.array("B", [self.BLANK]) * self.size + self.level
+        tree.extend(array.array("B", [self.BLANK]) * (self.size - len(lines)))
+        for i in range(self.size - 1, 0, -1):
+            tree[i] = min(tree[2 * i], tree[2 * i + 1])
+        self.tree = tree
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(map(sys.getsizeof, (
+                        self.line_start, self.level, self.offset, self.head, self.tree)))
+
+    def row(self, point):
+        return bisect.bisect_right(self.line_start, point) - 1
+
+    def next_le(self, row, level, stop):
+        # first row in [row, stop) whose level <= level, or -1
+        if row >= stop:
+            return -1
+        tree, i = self.tree, row + self.size
+        while tree[i] > level:
+            while i & 1:
+                i >>= 1
+            if i == 0:
+                return -1
+            i += 1
+        while i < self.size:
+            i = 2 * i if tree[2 * i] <= level else 2 * i + 1
+        i -= self.size
+        return i if i < stop else -1
+
+    def last_filled(self, start, stop):
+        # line_start of the last non-blank row in [start, stop), or None
+        stop = min(stop, len(self.level))
+        return next((self.line_start[i]  for i in range(stop - 1, start - 1, -1)
+                                            if self.level[i] != self.BLANK), None)
+
+
+class Intervals:
+    # sorted, disjoint [starts[i], ends[i]) of (begin, end) spans
+
+    def __init__(self, spans):
+        spans = [*spans]
+        self.starts = array.array("i", map(opr.itemgetter(0), spans))
+        self.ends = array.array("i", map(opr.itemgetter(1), spans))
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(map(sys.getsizeof, (self.starts, self.ends)))
+
+    def __contains__(self, point):
+        i = bisect.bisect_right(self.starts, point) - 1
+        return i >= 0 and point < self.ends[i]
+
+    def span(self, point):
+        # (point in self, next point where it may change)
+        i = bisect.bisect_right(self.starts, point) - 1
+        if i >= 0 and point < self.ends[i]:
+            return (True, self.ends[i])
+        return (False, self.starts[i + 1] if i + 1 < len(self.starts) else math.inf)
+
+
+class IgnoredIndex(Intervals):
+    # ignored_scope intervals, head_flags[row] of ignored_characters
+
+    def __init__(self, spans, heads, characters, selector, change_count):
+        super().__init__(spans)
+        self.characters = characters
+        self.selector = selector
+        self.change_count = change_count
+        self.head_flags = bytes(map(characters.__contains__, heads))
+
+    def __sizeof__(self):
+        return super().__sizeof__() + sys.getsizeof(self.head_flags)
+
+
+def scan_rows(profile, ignored, start_row, stop_row, target_indentlevel):
+    # (last scanned line_start or None, ({level: point}, {level: ignored point}))
+
+    tgtlvl = target_indentlevel
+    row = start_row
+    closed_t, closed_f = {}, {}
+
+    while (row := profile.next_le(row, tgtlvl, stop_row)) >= 0:
+
+        pt = profile.line_start[row]
+        idtlvl = profile.level[row]
+
+        if ignored.head_flags[row] or pt + profile.offset[row] in ignored:
+            closed_f.setdefault(idtlvl, pt)
+
+        else:
+            closed_t.setdefault(idtlvl, pt)
+            tgtlvl = idtlvl - 1
+            if tgtlvl < 0:
+                return (pt, (closed_t, closed_f))
+        row += 1
+
+    return (profile.last_filled(start_row, stop_row), (closed_t, closed_f))
+
+
+def as_text(text):
+    # str of a str, bytes, bytearray or memoryview
+    return text if isinstance(text, str) else str(text, "utf-8")
+
+
+def indentation_levels(text, tab_size, points):
+    # view.indentation_level of each point
+    text = as_text(text)
+    levels = array.array("B")
+    for pt in points:
+        a, b = text.rfind("\n", 0, pt) + 1, text.find("\n", pt)
+        line = text[a:len(text) if b < 0 else b]
+        width = len(line) - len(line.lstrip(" \t"))
+        levels.append(min(len(line[:width].expandtabs(tab_size)) // tab_size, 254))
+    return levels
+
+
+def scan_text(text, tab_size, points, next_points, levels, spans, characters, offset=0):
+    # [(scanned_point, closed_t, closed_f), ...] of completely scanned symbols, 
+    # next_points[i]: the line where the scan of symbol i ends,  text starts at offset
+    profile = IndentProfile(as_text(text), tab_size, 0)
+    ignored = IgnoredIndex(spans, profile.head, characters, None, 0)
+    shift = offset.__add__
+    results = []
+
+    for pt, nextpt, lvl in zip(map((-offset).__add__, points), 
+                               map((-offset).__add__, next_points), levels):
+        start_row, last_row = profile.row(pt) + 2, profile.row(nextpt) + 1
+        scanned, closed = None, ({}, {})
+        if start_row < last_row:
+            scanned, closed = scan_rows(profile, ignored, start_row, last_row, lvl)
+        results.append((shift(pt if scanned is None else scanned), 
+                        *({lv: shift(p)  for lv, p in dct.items()}  for dct in closed)))
+    return results
+
+
+def split(levels, parts):
+    # [(start, stop), ...] symbol index ranges cut at the top level
+    toplvl = min(levels, default=0)
+    tops = [i  for i, lvl in enumerate(levels) if lvl == toplvl]
+    if not tops:
+        return []
+    tops[0] = 0
+    size = -(-len(levels) // max(parts, 1))
+    cuts = [0]
+    for i in tops:
+        if i - cuts[-1] >= size:
+            cuts.append(i)
+    return [*zip(cuts, [*cuts[1:], len(levels)])]
+
+
+def scan_parallel(text, tab_size, points, levels, spans, characters, executor, parts):
+    # scan_text over parts of text submitted to executor (threads or processes)
+    text = as_text(text)
+    next_points = [*points[1:], len(text)]
+    jobs = []
+
+    for start, stop in split(levels, parts):
+        # whole lines from the first symbol to the line of the last next_point
+        a = text.rfind("\n", 0, points[start]) + 1
+        b = text.find("\n", next_points[stop - 1])
+        b = len(text) if b < 0 else b
+        lo, hi = bisect.bisect_right(spans, (a, )), bisect.bisect_left(spans, (b, ))
+        lo -= lo > 0 and spans[lo - 1][1] > a
+        part_spans = [(max(s, a) - a, min(e, b) - a)  for s, e in spans[lo:hi]]
+        jobs.append(executor.submit(scan_text, text[a:b], tab_size, 
+                                    points[start:stop], next_points[start:stop], 
+                                    levels[start:stop], part_spans, characters, a))
+
+    return [*itools.chain.from_iterable(job.result()  for job in jobs)]
@@ -0,0 +1,189 @@
+import sublime
+
+import os
+import re
+import threading
+import operator as opr
+import concurrent.futures as cfutures
+from typing import ClassVar
+
+from .containers import Pkg
+from .engine import IndentProfile
+
+
+class ProjectIndex:
+    # path --> (mtime_ns, ((name, row), ...))   top level symbols of files under the window folders
+    #   a file's top level is the shallowest indentation among its definitions (Cache.top_indices)
+    PATTERNS: ClassVar[dict] = {
+        ".py":  r'^[ \t]*(?:async[ \t]+)?(?:def|class)[ \t]+(\w+)',
+        ".js":  r'^[ \t]*(?:export[ \t]+(?:default[ \t]+)?)?(?:async[ \t]+)?'
+                r'(?:function\*?|class)[ \t]+([\w$]+)',
+        ".ts":  r'^[ \t]*(?:export[ \t]+(?:default[ \t]+)?)?(?:declare[ \t]+)?(?:abstract[ \t]+)?'
+                r'(?:async[ \t]+)?(?:function\*?|class|interface|enum|namespace)[ \t]+([\w$]+)',
+        ".go":  r'^func[ \t]+(?:\([^)\n]*\)[ \t]*)?(\w+)|^type[ \t]+(\w+)',
+        ".rs":  r'^[ \t]*(?:pub(?:\([^)\n]*\))?[ \t]+)?(?:async[ \t]+)?(?:unsafe[ \t]+)?'
+                r'(?:fn|struct|enum|trait|impl(?:<[^>\n]*>)?|mod)[ \t]+(\w+)',
+        ".c":   r'^(?:[A-Za-z_][\w*& \t]*[ \t*&])?([A-Za-z_]\w*)[ \t]*\([^;\n]*$'
+                r'|^(?:typedef[ \t]+)?(?:struct|union|enum|class)[ \t]+(\w+)[^;\n]*$',
+        ".rb":  r'^[ \t]*(?:class|module|def)[ \t]+([\w:.?!]+)',
+        ".lua": r'^[ \t]*(?:local[ \t]+)?function[ \t]+([\w.:]+)',
+    }
+    ALIASES: ClassVar[dict] = {".pyw": ".py", ".mjs": ".js", ".cjs": ".js", ".jsx": ".js",
+                               ".tsx": ".ts", ".h": ".c", ".cc": ".c", ".cpp": ".c",
+                               ".cxx": ".c", ".hpp": ".c", ".hh": ".c"}
+    SKIP_DIRS: ClassVar[frozenset] = frozenset((".git", ".hg", ".svn", "__pycache__",
+                                                "node_modules", ".venv", "venv", ".tox"))
+    MAX_FILES: ClassVar[int] = 50000
+    MAX_FILE_SIZE: ClassVar[int] = 2 << 20   # bytes
+    TAB_SIZE: ClassVar[int] = 4
+    WORKERS: ClassVar[int] = 4
+
+    files: ClassVar[dict] = {}
+    indexed: ClassVar[set] = set()     # folders walked at least once
+    generation: ClassVar[int] = 0
+    lock: ClassVar[object] = threading.Lock()
+    panels: ClassVar[dict] = {}        # folders --> (generation, locations, QuickPanelItems)
+
+    @classmethod
+    def patterns(cls):
+        # {".ext": compiled}, "project_symbols" extends or replaces the built-ins
+        table = {**cls.PATTERNS, **Pkg.settings.get("project_symbols", {})}
+        compiled = {ext: re.compile(rgx, re.MULTILINE)  for ext, rgx in table.items() if rgx}
+        aliases = ((alias, compiled.get(ext))  for alias, ext in cls.ALIASES.items()
+                                                            if alias not in table)
+        compiled.update((alias, rgx)  for alias, rgx in aliases if rgx is not None)
+        return compiled
+
+    @classmethod
+    def scan_text(cls, text, pattern):
+        # ((name, row), ...) of the definitions at the shallowest level
+        matches = [*pattern.finditer(text)]
+        if not matches:
+            return ()
+        profile = IndentProfile(text, cls.TAB_SIZE, 0)
+        rows = [*map(profile.row, map(opr.methodcaller("start"), matches))]
+        lvls = [*map(profile.level.__getitem__, rows)]
+        names = (next(filter(None, m.groups()), "")  for m in matches)
+        toplvl = min(lvls)
+        return tuple((name, row)  for name, row, lvl in zip(names, rows, lvls)
+                                                if lvl == toplvl and name)
+
+    @classmethod
+    def scan_file(cls, path, pattern):
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                return cls.scan_text(f.read(), pattern)
+        except OSError:
+            return ()
+
+    @classmethod
+    def walk(cls, folders, patterns):
+        # (path, mtime_ns) of indexable files
+        count = 0
+        for folder in folders:
+            for root, dirs, names in os.walk(folder):
+                dirs[:] = [d  for d in dirs if d not in cls.SKIP_DIRS]
+                for name in names:
+                    if os.path.splitext(name)[1].lower() not in patterns:
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    if stat.st_size > cls.MAX_FILE_SIZE:
+                        continue
+                    yield path, stat.st_mtime_ns
+                    count += 1
+                    if count >= cls.MAX_FILES:
+                        return
+
+    @classmethod
+    def refresh(cls, folders):
+        # rescan new or modified files in a thread pool, drop vanished ones
+        folders = tuple(folders)
+        patterns = cls.patterns()
+        found = dict(cls.walk(folders, patterns))
+        stale = [path  for path, mtime in found.items()
+                            if cls.files.get(path, (None, ))[0] != mtime]
+
+        def scan(path):
+            return cls.scan_file(path, patterns[os.path.splitext(path)[1].lower()])
+
+        with cfutures.ThreadPoolExecutor(max_workers=cls.WORKERS) as pool:
+            scanned = [*zip(stale, pool.map(scan, stale))]
+
+        prefixes = tuple(os.path.join(folder, "")  for folder in folders)
+        with cls.lock:
+            vanished = [path  for path in cls.files
+                                if path.startswith(prefixes) and path not in found]
+            for path in vanished:
+                del cls.files[path]
+            for path, symbols in scanned:
+                cls.files[path] = (found[path], symbols)
+            cls.indexed.update(folders)
+            if scanned or vanished:
+                cls.generation += 1
+        cls.items(folders)   # the panel opens from cache
+
+    @classmethod
+    def update(cls, path):
+        # a saved file of an indexed folder
+        if path is None or not any(path.startswith(os.path.join(folder, ""))
+                                                for folder in cls.indexed):
+            return
+        pattern = cls.patterns().get(os.path.splitext(path)[1].lower())
+        if pattern is None:
+            return
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        symbols = cls.scan_file(path, pattern)
+        with cls.lock:
+            if cls.files.get(path) == (mtime, symbols):
+                return
+            cls.files[path] = (mtime, symbols)
+            cls.generation += 1
+        for folders in [*cls.panels]:
+            cls.items(folders)
+
+    @classmethod
+    def ready(cls, folders):
+        return cls.indexed.issuperset(folders)
+
+    @classmethod
+    def items(cls, folders):
+        # ([(path, row), ...], QuickPanelItems), rebuilt only when the index changed
+        folders = tuple(folders)
+        cached = cls.panels.get(folders)
+        if cached is not None and cached[0] == cls.generation:
+            return cached[1:]
+
+        prefixes = [os.path.join(folder, "")  for folder in folders]
+        with cls.lock:
+            generation = cls.generation
+            files = sorted(cls.files.items())
+
+        locations, qpitems = [], []
+        kind = (sublime.KIND_ID_FUNCTION, "f", "")
+        for path, (_, symbols) in files:
+            prefix = next((p  for p in prefixes if path.startswith(p)), None)
+            if prefix is None:
+                continue
+            relpath = path[len(prefix):]
+            for name, row in symbols:
+                locations.append((path, row))
+                qpitems.append(sublime.QuickPanelItem(trigger=name, kind=kind,
+                                                      annotation=f'{relpath}:{row + 1}'))
+
+        cls.panels[folders] = (generation, locations, qpitems)
+        return (locations, qpitems)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.files.clear()
+            cls.indexed.clear()
+            cls.panels.clear()
+            cls.generation += 1
@@ -3,13 +3,20 @@ import sublime_plugin
 
 import html
 import re
+import os
+import json
 import itertools as itools
 import functools as ftools
 import operator as opr
-import math
+import time
+import bisect
+from typing import ClassVar
 
-from .sub.containers import Const, Pkg, ChainMapEx, Closed, Cache
+from .sub.containers import Const, Pkg, Cache, Hover, Stats, Presenter
 from .sub.byproducts import FTOCmd, GTLSCmd, MOCmd, GSWFCmd
+from .sub.diskcache import DiskCache
+from .sub.projectindex import ProjectIndex
+from .sub.engine import scan_rows
 
 
 def plugin_loaded():
@@ -19,154 +26,272 @@ def plugin_loaded():
 class SymbolBalloonListner(sublime_plugin.ViewEventListener):
     is_panel = False
 
+    def on_load_async(self):
+        if self.view.syntax() is not None and self.view.element() is None:
+            DiskCache.restore(self.view)
+            ScanWorker.start(self.view)
+
+    def on_post_save_async(self):
+        DiskCache.store(self.view)
+        ProjectIndex.update(self.view.file_name())
+
     def on_activated_async(self):
         if self.view.syntax() is None:
             return
         if self.view.element() is None:
             if not self.is_panel:
+                DiskCache.restore(self.view)
                 Cache.query_init(self.view)
+                ScanWorker.start(self.view)
+                if (self.view.id() in Balloon.followed or 
+                                Pkg.settings.get("follow_viewport", False)):
+                    sublime.set_timeout(lambda: Balloon.follow(self.view, True))
             self.is_panel = False
         else:
             self.is_panel = True
 
+    def on_modified_async(self):
+        change_count = self.view.change_count()
+        sublime.set_timeout_async(lambda: self.on_modified_settled(change_count), 
+                                  Const.REBUILD_DELAY)
+
+    def on_modified_settled(self, change_count):
+        # the symbol table off the main thread, only the last edit of a burst gets past settled
+        if self.settled(change_count):
+            Cache.query_init(self.view)
+            ScanWorker.start(self.view)
+            sublime.set_timeout_async(lambda: self.on_modified_idle(change_count), 
+                                      Const.PREBUILD_DELAY - Const.REBUILD_DELAY)
+
+    def on_modified_idle(self, change_count):
+        # quick panel items for the next goto
+        vw = self.view
+        if not self.settled(change_count):
+            return
+        Cache.query_init(vw)
+        if Cache.views["symbol_point"] and not Cache.views.get("lazy"):
+            GTLSCmd.items(vw)
+            GSWFCmd.items(vw)
+
+    def settled(self, change_count):
+        vw = self.view
+        return (vw.is_valid() and vw.change_count() == change_count and 
+                                    vw.syntax() is not None and vw.element() is None)
+
     def on_pre_close(self):
-        Cache.views.move_to_child(lambda dct: dct["id"] == self.view.id(),
-                                  lambda: {"id": -1})
-        del Cache.views.maps[0]
+        Balloon.follow(self.view, False)
+        Presenter.forget(self.view)
+        MiniOutlineCommand.outlined.pop(self.view.id(), None)
+        if len(self.view.buffer().views()) <= 1:
+            ScanWorker.tokens.pop(self.view.buffer_id(), None)
+            ScanWorker.callbacks.pop(self.view.buffer_id(), None)
+            Cache.forget(self.view)
 
     def on_hover(self, point, hover_zone):
         if (hover_zone == sublime.HOVER_GUTTER or 
                         Pkg.settings.get("mini_outline", "none") == "none"):
             return
-        vw = self.view
-        vrgn = vw.visible_region()
-        _, vis = vw.text_to_layout(vrgn.begin())
-        lh = vw.line_height()
+        generation = Hover.advance(self.view)
+        sublime.set_timeout_async(lambda: self.on_hover_settled(point, generation), 
+                                  Pkg.settings.get("hover_debounce_ms", 80))
 
-        _, viewport = vw.viewport_extent()
+    def on_hover_settled(self, point, generation):
+        vw = self.view
+        if not vw.is_valid() or not Hover.is_newest(vw, generation):
+            return
+        vis, lh, viewport, curr, tgt = Hover.layout(vw)
         _, mouse = vw.text_to_layout(point)
 
         if vis - lh < mouse < vis + viewport * 0.18:
-            curr = vw.layout_to_text((0, vis + max(lh, viewport * 0.13)))
-            tgt = vw.layout_to_text((0, vis + viewport * 0.18))
+            vw.run_command("mini_outline", 
+                           args={ "current": curr, "target": tgt, "generation": generation })
 
-            vw.run_command("mini_outline", args={ "current": curr, "target": tgt })
 
+class SymbolBalloonTextListner(sublime_plugin.TextChangeListener):
 
-def scan_manager(scanlines):
+    def on_text_changed(self, changes):
+        Cache.record_changes(self.buffer, changes)
 
-    def _scan_manager_(view, start_point, end_point):
-
-        stopper = itools.repeat(True, Pkg.settings.get("max_scan_lines", 20000))
-
-        sym_pts = Cache.views["symbol_point"] + (Cache.views["size"], )
-        index = sym_pts.index(start_point)
-        sympts = itools.takewhile(lambda pt: pt < end_point, sym_pts[index:])
-        
-        zipped = zip(Cache.views["scanned_point"][index:], 
-                     sym_pts[index + 1:],
-                     sympts,
-                     Cache.views["symbol_level"][index:],
-                     itools.count(start=index))
 
-        for scanpt, nextsym, sympt, symlvl, idx in zipped:
+class ScanWorker:
+    # Fills scanned_point/closed of a whole view in time slices.
+    tokens: ClassVar[dict] = {}
+    callbacks: ClassVar[dict] = {}   # buffer_id --> {name: (callback, start_point, end_point)}
 
-            if sympt < end_point < scanpt:
-                continue
-            delta_rgn = view.full_line(sublime.Region(scanpt, min(nextsym, end_point)))
-            fulllines = view.substr(delta_rgn).splitlines(True)
+    @classmethod
+    def start(cls, view):
+        cls.tokens[view.buffer_id()] = token = object()
+        sublime.set_timeout_async(lambda: cls.step(view, token, view.change_count()))
 
-            linestart_pts = itools.accumulate(map(len, fulllines), initial=delta_rgn.a)
+    @classmethod
+    def resume(cls, view, name, callback, start_point, end_point):
+        # finish an interrupted scan in the background, then run callback on the main thread
+        cls.callbacks.setdefault(view.buffer_id(), {})[name] = (callback, start_point, end_point)
+        cls.start(view)
 
-            start_row = 2 if scanpt == sympt else 0
-            zp = itools.islice(zip(linestart_pts, fulllines, stopper), start_row, None)
-            line_tpls = ((pt, fline)  for pt, fline, _ in zp if not fline.isspace())
+    @classmethod
+    def cancel(cls, view, name):
+        cls.callbacks.get(view.buffer_id(), {}).pop(name, None)
 
-            new_scannedpt, closed = scanlines(view, line_tpls, symlvl)
-
-            if new_scannedpt is not None:
-                Cache.views["scanned_point"][idx] = new_scannedpt
-                Cache.views["closed"][idx].appendflat(closed)
-
-        return next(stopper, False)
-
-    return _scan_manager_
-
-
-@scan_manager
-def scan_lines(view, line_tuples, target_indentlevel):
-
-    ignrchr = Pkg.settings.get("ignored_characters", "")
-    ignrscope = Pkg.settings.get("ignored_scope", "_")
-    tabsize = int(view.settings().get('tab_size', 8))
-
-    tgtlvl = target_indentlevel
-    pt = None
-    closed = Closed()
+    @classmethod
+    def step(cls, view, token, change_count):
+        if (cls.tokens.get(view.buffer_id()) is not token or not view.is_valid() or 
+                                        view.change_count() != change_count):
+            return
 
-    for pt, fullline in line_tuples:
+        Cache.query_init(view)
+        sym_pts = Cache.views.get("symbol_point")
+        if not sym_pts or not view.scope_name(0).startswith("source"):
+            return
+        if Cache.views.get("lazy"):
+            # large file mode scans only the ranges the waiting commands asked for
+            pending = cls.callbacks.get(view.buffer_id(), {})
+            deadline = time.perf_counter() + Const.SCAN_SLICE
+            for name, waiting in [*pending.items()]:
+                callback, start_point, end_point = waiting
+                if not scan_lines(view, start_point, end_point, deadline, resume=True):
+                    break
+                if pending.get(name) is waiting:
+                    del pending[name]
+                    sublime.set_timeout(callback)
+            if pending:
+                sublime.set_timeout_async(lambda: cls.step(view, token, change_count), 
+                                          Const.SCAN_INTERVAL)
+            else:
+                cls.tokens.pop(view.buffer_id(), None)
+            return
 
-        if tgtlvl == 0:
-            topchr = fullline[0:1]
-            if topchr.isspace():
-                continue
-            idtwidth = idtlvl = 0
+        cursor = Cache.views["scan_cursor"]
+        deadline = time.perf_counter() + Const.SCAN_SLICE
+        while cursor < len(sym_pts):
+            stop = min(cursor + Const.SCAN_CHUNK, len(sym_pts))
+            end = sym_pts[stop] if stop < len(sym_pts) else Cache.views["size"] + 1
+            if not scan_lines(view, sym_pts[cursor], end, deadline):
+                break
+            cursor = stop
 
+        Cache.views["scan_cursor"] = cursor
+        if cursor < len(sym_pts):
+            sublime.set_timeout_async(lambda: cls.step(view, token, change_count), 
+                                      Const.SCAN_INTERVAL)
         else:
-            fline = fullline.expandtabs(tabsize)
-            topchr = fline.lstrip()[0:1]
-            idtwidth = fline.index(topchr)
-            idtlvl = math.ceil(idtwidth / tabsize)
-            if tgtlvl < idtlvl:
-                continue
-            idtwidth = fullline.index(topchr)
+            Cache.views["scan_completed"] = True
+            cls.tokens.pop(view.buffer_id(), None)
+            DiskCache.store(view)
+            for callback, *_ in cls.callbacks.pop(view.buffer_id(), {}).values():
+                sublime.set_timeout(callback)
 
-        if topchr in ignrchr or view.match_selector(pt + idtwidth, ignrscope):
-            closed.false.setdefault(idtlvl, pt)
 
-        else:
-            closed.true.setdefault(idtlvl, pt)
-            tgtlvl = idtlvl - 1
-            if tgtlvl < 0:
-                break
+def scan_manager(scanlines):
 
-    return (pt, closed)
+    def _scan_manager_(view, start_point, end_point, deadline=None, resume=False):
+        # False when the deadline (perf_counter) interrupted the scan
+        #   resume: continues the previous call, whose chunks stay resident
+
+        with Cache.views["scan_lock"]:   # one thread at a time fills an entry
+            if deadline is None:
+                deadline = time.perf_counter() + Pkg.settings.get("max_scan_ms", 20) / 1000
+            scanned, advanced, completed = 0, False, True
+            profile = Cache.indent_profile(view)
+            ignored = Cache.ignored_index(view, profile)
+
+            sym_pts = Cache.views["symbol_point"]
+            closes = Cache.views["closed"]
+            done = Cache.views["scan_done"]   # 1: scanned to the next symbol or closed at level 0
+            closes.epoch += not resume
+            index = bisect.bisect_left(sym_pts, start_point)
+            stop = bisect.bisect_left(sym_pts, end_point)
+            closes.pin(index, stop)
+
+            while (idx := done.find(0, index, stop)) >= 0:
+
+                index = idx + 1
+                sympt = sym_pts[idx]
+                scanpt = Cache.views["scanned_point"][idx]
+                if end_point < scanpt:
+                    continue    # scanned beyond end_point
+                if closes.shutter[idx] == 0:
+                    done[idx] = 1
+                    continue
+                if time.perf_counter() > deadline:
+                    completed = False
+                    break
+                nextsym = sym_pts[idx + 1] if idx + 1 < len(sym_pts) else Cache.views["size"]
+
+                start_row = profile.row(scanpt) + (2 if scanpt == sympt else 0)
+                last_row = profile.row(min(nextsym, end_point)) + 1
+                tgtlvl = Cache.views["symbol_level"][idx]
+
+                # in slices of rows, so that a long symbol cannot overrun the deadline
+                while start_row < last_row and tgtlvl >= 0:
+                    stop_row = min(last_row, start_row + Const.SCAN_ROWS)
+                    scanned += stop_row - start_row
+
+                    new_scannedpt, closed = scanlines(profile, ignored, start_row, stop_row, tgtlvl)
+
+                    if new_scannedpt is not None:
+                        # stop only after progress, the next call resumes from scanned_point
+                        advanced = advanced or new_scannedpt > scanpt
+                        Cache.views["scanned_point"][idx] = scanpt = new_scannedpt
+                        closes.record(idx, *closed)
+
+                    tgtlvl = min(tgtlvl, min(closed[0], default=tgtlvl + 1) - 1)
+                    start_row = stop_row
+                    if start_row < last_row and advanced and time.perf_counter() > deadline:
+                        completed = False
+                        break
+
+                if not completed:
+                    break
+                if tgtlvl < 0 or nextsym <= end_point:
+                    done[idx] = 1
+
+            Stats.count(view, "lines_scanned", scanned)
+            if scanned:
+                Cache.account("closed", closes)    # chunks and the shutter tree grow
+            if not completed:
+                Stats.count(view, "scan_interrupted")
+            return completed
 
+    return _scan_manager_
 
-class RaiseSymbolBalloonCommand(sublime_plugin.TextCommand):
 
-    def run(self, edit):
-        
-        def navigate(href):
-            nonlocal vw
-            vw.show(int(href),
-                    show_surrounds=False,
-                    animate=True,
-                    keep_to_left=True)
+scan_lines = scan_manager(scan_rows)
 
-        def annotation_navigate(href):
-            nonlocal vw
-            vw.erase_regions(Const.KEY_ID)
 
-        vw = self.view
-        Cache.query_init(vw)
-        Pkg.init_settings()
+class Balloon:
+    # markup per chain of enclosing symbols, the follow mode
+    followed: ClassVar[set] = set()   # view.id() of the follow mode
+    polls: ClassVar[dict] = {}        # view.id() --> token of the viewport poll
+    prefetching: ClassVar[set] = set()
 
-        vpoint = vw.visible_region().begin()
+    @staticmethod
+    def anchor(view, lines):
+        vpoint = view.visible_region().begin()
         offset = Pkg.settings.get("row_offset", 0)
-        vpoint = vw.text_point(vw.rowcol(vpoint)[0] + offset, 0)
+        return lines.text_point(lines.row(vpoint) + offset, 0)
 
+    @staticmethod
+    def top_level_point(vpoint):
+        # the scan of the balloon above vpoint starts here, None without symbols above
         sym_pts = itools.takewhile(lambda pt: pt < vpoint, Cache.views["symbol_point"])
         nearly_symbol = dict(zip(Cache.views["symbol_level"], sym_pts))
-        if not nearly_symbol:
-            return
-
-        top_level_pt = nearly_symbol[min(nearly_symbol)]
-        is_source = vw.scope_name(0).startswith("source")
-
-        if is_source:
-            completed = scan_lines(vw, top_level_pt, vpoint + 1)
-            visible_symbol, ignoredpt = Cache.sectional_view(vpoint + 1)
+        return nearly_symbol[min(nearly_symbol)] if nearly_symbol else None
+
+    @classmethod
+    def chain(cls, view, vpoint, lap=None):
+        # (visible_symbol, ignoredpt, completed) above vpoint, or None
+        top_level_pt = cls.top_level_point(vpoint)
+        if top_level_pt is None:
+            return None
+
+        if view.scope_name(0).startswith("source"):
+            with Cache.views["scan_lock"]:   # no other thread's scan in between
+                completed = (Cache.views.get("scan_completed") or 
+                                scan_lines(view, top_level_pt, vpoint + 1))
+                if lap is not None:
+                    lap("scan")
+                visible_symbol, ignoredpt = Cache.sectional_view(vpoint + 1)
 
         else:
             visible_symbol, _ = Cache.sectional_view(vpoint + 1)
@@ -174,51 +299,60 @@ class RaiseSymbolBalloonCommand(sublime_plugin.TextCommand):
             completed = True
 
         if not visible_symbol:
-            return
-        symbol_infos = [*visible_symbol.values()]
+            return None
+        return (visible_symbol, ignoredpt, completed)
 
-        vw.run_command("break_symbol_balloon")
-        markup = ""
-        is_param = ("meta.function.parameters | meta.class.parameters "
-                    "| meta.class.inheritance | meta.method.parameters")
-        is_def = "meta.function | meta.class | meta.section.latex"
-        
-        tabsize = int(vw.settings().get('tab_size', 8))
+    @staticmethod
+    def key(visible_symbol, ignoredpt, completed):
+        return (*(sr.region.a  for sr in visible_symbol.values()), ignoredpt, completed)
+
+    @classmethod
+    def markup(cls, view, visible_symbol, completed):
+        # balloon html of a chain, once per change_count
+        tabsize = int(view.settings().get('tab_size', 8))
         symcolor = Pkg.settings.get("symbol_color", "var(--foreground)")
-        to_html = ftools.partial(vw.export_to_html, 
+        fontsize = Pkg.settings.get("font_size", 0.95)
+        key = (*(sr.region.a  for sr in visible_symbol.values()), 
+               completed, tabsize, symcolor, fontsize)
+
+        markups = Cache.derived("balloon_markup", dict)
+        if key in markups:
+            return markups[key]
+
+        markup = ""
+        is_source = view.scope_name(0).startswith("source")
+        lines = Cache.line_index(view)
+        to_html = ftools.partial(view.export_to_html, 
                                  minihtml=True, enclosing_tags=False, 
                                  font_size=False, font_family=False)
-        preds = [
-            lambda pt: vw.match_selector(pt, is_param) ^ vw.match_selector(pt, is_def),
-            lambda pt: vw.match_selector(pt, is_param)]
+        signatures = Cache.signature_index(view)
 
-        for symbol in symbol_infos:
+        for symbol in visible_symbol.values():
 
             symbolpt = symbol.region.a
             symbolpt_b = symbol.region.b
-            prm_max = symbolpt_b + 1500
-            itrng = iter(range(symbolpt_b, prm_max))
-
-            drops = map(itools.dropwhile, preds, [itrng] * 2)
-            param = vw.substr(sublime.Region(*map(next, drops, [prm_max] * 2)))
-            param = re.sub(r'^[ \t]+', ' ', param, flags=re.MULTILINE)
-            param = html.escape(param, quote=True).expandtabs(tabsize).replace(" ",  "&nbsp;")
-
-            row = vw.rowcol(symbolpt)[0] + 1
+            param = signatures.tooltips.get((symbolpt_b, tabsize))
+            if param is None:
+                param = view.substr(sublime.Region(*signatures.region(symbolpt_b)))
+                param = re.sub(r'^[ \t]+', ' ', param, flags=re.MULTILINE)
+                param = html.escape(param, quote=True).expandtabs(tabsize).replace(" ",  "&nbsp;")
+                signatures.tooltips[(symbolpt_b, tabsize)] = param
+
+            row = lines.row(symbolpt) + 1
             
-            linergn = vw.line(symbolpt)
+            linergn = lines.line(symbolpt)
 
             if is_source:
                 symname = symbol.name
             else:
-                rgns, scps = zip(*vw.extract_tokens_with_scopes(linergn))
+                rgns, scps = zip(*view.extract_tokens_with_scopes(linergn))
                 nmrgns = itools.compress(rgns, map(lambda scp: "entity.name" in scp, scps))
-                symname = "".join(map(vw.substr, nmrgns))
+                symname = "".join(map(view.substr, nmrgns))
 
             if symcolor == "color_scheme":
                 kwd, sym, prm = to_html(linergn), "", ""
             else:
-                kwd, sym, prm = vw.substr(linergn).partition(symname or "---")
+                kwd, sym, prm = view.substr(linergn).partition(symname or "---")
 
                 kwd, sym, prm = map(lambda st:
                         html.escape(st).expandtabs(tabsize).replace(" ",  "&nbsp;"),
@@ -231,25 +365,118 @@ class RaiseSymbolBalloonCommand(sublime_plugin.TextCommand):
                             f'<span class="row">&nbsp;..{row}</span>'
                         '</a><br>')
 
-        fontsize = Pkg.settings.get("font_size", 0.95)
         ballooncolor = "#dcf" if completed else "#d77"
-
-        con = (f'<body id="symbolballoon">{_stylesheet(symcolor, fontsize, ballooncolor)}'
+        con = markups[key] = (
+                f'<body id="symbolballoon">{_stylesheet(symcolor, fontsize, ballooncolor)}'
                     '<div class="arrow"></div>'
                 f'<div class="balloon">{markup}</div></body>')
+        Cache.account(("derived", "balloon_markup"), con, grow=True)
+        return con
+
+    @classmethod
+    def follow(cls, view, enable):
+        if enable:
+            cls.followed.add(view.id())
+            cls.polls[view.id()] = token = object()   # a running poll stops
+            cls.poll(view, token, None)
+        else:
+            cls.followed.discard(view.id())
+            cls.polls.pop(view.id(), None)
+
+    @classmethod
+    def poll(cls, view, token, state):
+        # redraw when the viewport or the text changed, while the view is in front
+        window = view.window()
+        if (cls.polls.get(view.id()) is not token or not view.is_valid() or 
+                            window is None or window.active_view() != view):
+            if cls.polls.get(view.id()) is token:
+                del cls.polls[view.id()]    # on_activated_async polls again
+            return
+
+        new_state = (view.viewport_position(), view.change_count())
+        if new_state != state:
+            direction = -1 if state is not None and new_state[0][1] < state[0][1] else 1
+            view.run_command("raise_symbol_balloon", {"prefetch": direction})
+        sublime.set_timeout(lambda: cls.poll(view, token, new_state), Const.FOLLOW_INTERVAL)
+
+    @classmethod
+    def prefetch(cls, view, vpoint, direction):
+        # scan and build the balloons of the next rows in the scroll direction
+        if not view.is_valid() or view.id() in cls.prefetching:
+            return
+        cls.prefetching.add(view.id())
+        try:
+            Cache.query_init(view)
+            if not Cache.views["symbol_point"]:
+                return
+            lines = Cache.line_index(view)
+            row = lines.row(vpoint)
+            rows = Pkg.settings.get("follow_prefetch_rows", 60)
+            keys = set()
+            for r in range(row + direction, row + direction * (rows + 1), direction):
+                found = cls.chain(view, lines.text_point(r, 0))
+                if found is None or (key := cls.key(*found)) in keys:
+                    continue
+                keys.add(key)
+                cls.markup(view, found[0], found[2])
+            Stats.count(view, "balloon.prefetched", len(keys))
+        finally:
+            cls.prefetching.discard(view.id())
+
+
+class RaiseSymbolBalloonCommand(sublime_plugin.TextCommand):
+
+    @Stats.command("raise_symbol_balloon")
+    def run(self, edit, prefetch=0):
+        
+        def navigate(href):
+            nonlocal vw
+            vw.show(int(href),
+                    show_surrounds=False,
+                    animate=True,
+                    keep_to_left=True)
+
+        def annotation_navigate(href):
+            nonlocal vw
+            Presenter.clear_annotation(vw, Const.KEY_ID)
+
+        vw = self.view
+        lap = Stats.stopwatch(vw, "raise_symbol_balloon")
+        Cache.query_init(vw)
+        Pkg.init_settings()
+        lines = Cache.line_index(vw)
+        lap("query_init")
+
+        vpoint = Balloon.anchor(vw, lines)
+        found = Balloon.chain(vw, vpoint, lap)
+        lap("sectional_view")
+        if found is None:
+            if prefetch:
+                Presenter.clear(vw, Const.KEY_ID)   # follow mode, nothing above the top row
+            return
+        visible_symbol, ignoredpt, completed = found
+
+        if prefetch:
+            sublime.set_timeout_async(lambda: Balloon.prefetch(vw, vpoint, prefetch))
+
+        con = Balloon.markup(vw, visible_symbol, completed)
+        lap("html")
 
-        vw.add_phantom(Const.KEY_ID,
-                       sublime.Region(vpoint),
-                       con,
-                       sublime.LAYOUT_BELOW,
-                       on_navigate=navigate)
+        ScanWorker.cancel(vw, "balloon")
+        if vw.is_popup_visible():
+            vw.hide_popup()
+        Presenter.phantom(vw, Const.KEY_ID, vpoint, con, navigate)
 
         if ignoredpt is not None and Pkg.settings.get("show_ignored_indentation", False):
-            vw.add_regions(Const.KEY_ID,
-                           [sublime.Region(ignoredpt)],
-                           annotations=[_annotation_html()],
-                           annotation_color="#aa0",
-                           on_navigate=annotation_navigate)
+            Presenter.annotation(vw, Const.KEY_ID, ignoredpt, _annotation_html(), 
+                                 "#aa0", annotation_navigate)
+        else:
+            Presenter.clear_annotation(vw, Const.KEY_ID)
+        lap("phantom")
+
+        if not completed:
+            ScanWorker.resume(vw, "balloon", lambda: vw.run_command("raise_symbol_balloon"), 
+                              Balloon.top_level_point(vpoint), vpoint + 1)
 
 
 def _annotation_html():
@@ -296,17 +523,136 @@ def _stylesheet(symbol_color, font_size, balloon_color):
 class BreakSymbolBalloonCommand(sublime_plugin.TextCommand):
 
     def run(self, edit):
-        self.view.erase_phantoms(Const.KEY_ID)
+        ScanWorker.cancel(self.view, "balloon")
+        Presenter.clear(self.view, Const.KEY_ID)
         if self.view.is_popup_visible():
             self.view.hide_popup()
-        if len(self.view.get_regions(Const.KEY_ID)) != 0:
-            self.view.erase_regions(Const.KEY_ID)
+
+
+class FollowSymbolBalloonCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit, enable=None):
+        vw = self.view
+        enable = vw.id() not in Balloon.followed if enable is None else enable
+        Balloon.follow(vw, enable)
+        if not enable:
+            vw.run_command("break_symbol_balloon")
+
+    def is_checked(self, enable=None):
+        return self.view.id() in Balloon.followed
 
 
 class ClearCacheCommand(sublime_plugin.TextCommand):
 
     def run(self, edit):
-        Cache.views = ChainMapEx({"id": -1, "change_counter": -1})
+        Cache.clear()
+        ProjectIndex.clear()
+
+
+class SymbolBalloonMemoryReportCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit):
+        vw = self.view
+        Cache.query_init(vw)
+        if not Cache.views["symbol_point"]:
+            return
+
+        rows = Cache.memory_report()
+        packed, legacy = map(sum, zip(*((p, l)  for _, p, l in rows)))
+        lines = [f'{name:<18}{p:>12,}{l:>14,}'  for name, p, l in rows]
+        text = "\n".join([
+            f'{vw.file_name() or vw.name()}   {len(Cache.views["symbol_point"]):,} symbols',
+            f'{"":<18}{"packed":>12}{"tuple/dict":>14}',
+            *lines,
+            f'{"total":<18}{packed:>12,}{legacy:>14,}   ({packed / max(legacy, 1):.0%})', ""])
+        if Cache.views.get("lazy"):
+            closed = Cache.views["closed"]
+            text += (f'large file mode   chunks of {Const.LAZY_CHUNK:,} symbols   '
+                     f'closed {len(closed.chunks)}   evictions {closed.evictions:,}\n')
+
+        panel = vw.window().create_output_panel(Const.KEY_ID)
+        panel.run_command("append", {"characters": text})
+        vw.window().run_command("show_panel", {"panel": f"output.{Const.KEY_ID}"})
+
+
+class SymbolBalloonStatsCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit, export=False):
+        vw = self.view
+        lines = [] if Stats.on() else ['"instrumentation" is off (symbol_balloon.sublime-settings)', 
+                                       ""]
+
+        lines.append(f'{"span":<36}{"count":>8}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}')
+        lines.extend(f'{name:<36}{cnt:>8}{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}{mx * 1000:>10.2f}'
+                            for name, cnt, p50, p95, mx in Stats.percentiles())
+
+        entries, shown = Cache.entries, Presenter.counters
+        lines.extend(["", f'view cache   hits {entries.hits:,}   misses {entries.misses:,}   '
+                          f'evictions {entries.evictions:,}', 
+                      f'presenter    rendered {shown["rendered"]:,}   moved {shown["moved"]:,}   '
+                          f'skipped {shown["skipped"]:,}', 
+                      f'max_scan_ms {Pkg.settings.get("max_scan_ms", 20)}'])
+
+        for bid, counter in sorted(Stats.totals.items()):
+            here = " (this view)" if bid == vw.buffer_id() else ""
+            lines.extend(["", f'buffer {bid}{here}'])
+            lines.extend(f'    {key:<32}{cnt:>12,}'  for key, cnt in sorted(counter.items()))
+
+        if export:
+            path = os.path.join(DiskCache.directory(), "stats.json")
+            os.makedirs(DiskCache.directory(), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(Stats.export(), f, indent=1)
+            lines.extend(["", f'exported to {path}'])
+
+        panel = vw.window().create_output_panel(Const.KEY_ID)
+        panel.run_command("append", {"characters": "\n".join([*lines, ""])})
+        vw.window().run_command("show_panel", {"panel": f"output.{Const.KEY_ID}"})
+
+
+class GotoProjectSymbolCommand(sublime_plugin.WindowCommand):
+
+    def run(self):
+
+        def show():
+            nonlocal win, folders, origin
+            locations, qpitems = ProjectIndex.items(folders)
+            if not qpitems:
+                sublime.status_message("SymbolBalloon: no top level symbols in the project")
+                return
+
+            def open_location(idx, flags=0):
+                path, row = locations[idx]
+                win.open_file(f'{path}:{row + 1}', sublime.ENCODED_POSITION | flags)
+
+            def commit(idx):
+                if idx < 0:
+                    if origin is not None:
+                        win.focus_view(origin)   # cancel
+                    return
+                open_location(idx)
+
+            win.show_quick_panel(
+                    items=qpitems, 
+                    on_select=commit,
+                    on_highlight=lambda idx: open_location(idx, sublime.TRANSIENT),
+                    placeholder="Project top level")
+
+        win = self.window
+        folders = win.folders()
+        if not folders:
+            sublime.status_message("SymbolBalloon: no folders in this window")
+            return
+        origin = win.active_view()
+
+        if ProjectIndex.ready(folders):
+            show()
+            sublime.set_timeout_async(lambda: ProjectIndex.refresh(folders))   # outside changes
+            return
+
+        sublime.status_message("SymbolBalloon: indexing project ...")
+        sublime.set_timeout_async(lambda: (ProjectIndex.refresh(folders), 
+                                           sublime.set_timeout(show)))
 
 
 class FoldToOutlineCommand(FTOCmd):
@@ -322,21 +668,36 @@ class GotoSymbolWithFilterCommand(GSWFCmd):
 
 
 class MiniOutlineCommand(MOCmd):
+    outlined: ClassVar[dict] = {}   # view.id() --> generation of the entry last outlined
 
-    def run(self, edit, current, target):
+    @Stats.command("mini_outline")
+    def run(self, edit, current, target, generation=None, force=False):
 
         vw = self.view
-        update = Cache.query_init(vw)
+        if generation is not None and not Hover.is_newest(vw, generation):
+            return
+        Cache.query_init(vw)
         if not Cache.views["symbol_point"]:
             return
-        vpt = vw.full_line(vw.visible_region().begin()).end()
+        vpt = Cache.line_index(vw).full_line(vw.visible_region().begin()).end()
         tgtrgn = sublime.Region(vpt, target)
         rgns = vw.get_regions("MiniOutline")
+        update = self.outlined.get(vw.id()) != Cache.views.get("generation")
 
-        if update or not (rgns and tgtrgn.contains(rgns[0])):
+        if force or update or not (rgns and tgtrgn.contains(rgns[0])):
+            self.outlined[vw.id()] = Cache.views.get("generation")
 
             completed = True
-            if vw.scope_name(0).startswith("source"):
-                completed = scan_lines(vw, Cache.views["symbol_point"][0], current)
-
-            self.do(current, Pkg.settings.get("mini_outline", "symbol"), completed)
\ No newline at end of file
+            with Cache.views["scan_lock"]:
+                if (vw.scope_name(0).startswith("source") and 
+                                not Cache.views.get("scan_completed")):
+                    completed = scan_lines(vw, Cache.views["symbol_point"][0], current)
+
+                self.do(current, Pkg.settings.get("mini_outline", "symbol"), completed, generation)
+
+            if not completed:
+                ScanWorker.resume(vw, "mini_outline", lambda: vw.get_regions("MiniOutline") and 
+                                  vw.run_command("mini_outline", {"current": current, 
+                                                                  "target": target, 
+                                                                  "force": True}), 
+                                  Cache.views["symbol_point"][0], current)
\ No newline at end of file